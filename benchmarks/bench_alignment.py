@@ -0,0 +1,128 @@
+"""Benchmark the trial alignment of ActivityAlignment.make, without a database.
+
+Compares the per-trial loop that `make` used before vectorization with the
+vectorized path, in both storage modes, building the entries of the part table.
+Slicing the windows costs about the same either way; the per-trial loop spends most
+of its time reading the trial key from the pandas row once per (trial, ROI) entry.
+
+    python benchmarks/bench_alignment.py [--rois 1000] [--trials 500] [--frames 30000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from workflow_calcium_imaging.alignment import align_trials, get_alignment_start_indices
+from workflow_calcium_imaging.analysis import (
+    _iter_aligned_roi_activities,
+    _iter_aligned_trial_activities,
+)
+
+
+def per_trial_loop(trialized_event_times, activity_traces, trace_keys, min_limit, fps):
+    """Alignment loop of ActivityAlignment.make before vectorization."""
+    nsamples = int(round(2 * min_limit * fps))
+    aligned_trial_activities = []
+    for _, r in trialized_event_times.iterrows():
+        alignment_start_idx = int((r.event - min_limit) * fps)
+        roi_aligned_activities = activity_traces[
+            :, alignment_start_idx : (alignment_start_idx + nsamples)
+        ]
+        if roi_aligned_activities.shape[-1] != nsamples:
+            roi_aligned_activities = np.pad(
+                roi_aligned_activities,
+                ((0, 0), (0, nsamples - roi_aligned_activities.shape[-1])),
+                mode="constant",
+                constant_values=np.nan,
+            )
+        aligned_trial_activities.extend(
+            [
+                {**r.trial_key, **trace_key, "aligned_trace": aligned_trace}
+                for trace_key, aligned_trace in zip(trace_keys, roi_aligned_activities)
+            ]
+        )
+    return aligned_trial_activities
+
+
+def vectorized(
+    iter_aligned_activities,
+    event_times,
+    activity_traces,
+    trial_keys,
+    trace_keys,
+    min_limit,
+    fps,
+):
+    """Alignment of ActivityAlignment.make, in the storage mode of the iterator."""
+    nsamples = int(round(2 * min_limit * fps))
+    start_indices = get_alignment_start_indices(event_times, min_limit, fps)
+
+    def align(trials, rois):
+        return align_trials(activity_traces[rois], start_indices[trials], nsamples)
+
+    return [
+        entry
+        for batch in iter_aligned_activities({}, trial_keys, trace_keys, align, 50000)
+        for entry in batch
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rois", type=int, default=1000)
+    parser.add_argument("--trials", type=int, default=500)
+    parser.add_argument("--frames", type=int, default=30000)
+    args = parser.parse_args(argv)
+
+    fps, min_limit = 30.0, 2.5
+    rng = np.random.default_rng(0)
+    activity_traces = rng.standard_normal((args.rois, args.frames))
+    event_times = np.sort(rng.uniform(0, args.frames / fps, args.trials))
+    trial_keys = [{"trial_id": trial_id} for trial_id in range(args.trials)]
+    trace_keys = [{"mask": mask} for mask in range(args.rois)]
+    trialized_event_times = pd.DataFrame(dict(trial_key=trial_keys, event=event_times))
+
+    for name, run in (
+        (
+            "per-trial loop",
+            lambda: per_trial_loop(
+                trialized_event_times, activity_traces, trace_keys, min_limit, fps
+            ),
+        ),
+        (
+            'vectorized, storage_mode="trial"',
+            lambda: vectorized(
+                _iter_aligned_trial_activities,
+                event_times,
+                activity_traces,
+                trial_keys,
+                trace_keys,
+                min_limit,
+                fps,
+            ),
+        ),
+        (
+            'vectorized, storage_mode="roi"',
+            lambda: vectorized(
+                _iter_aligned_roi_activities,
+                event_times,
+                activity_traces,
+                trial_keys,
+                trace_keys,
+                min_limit,
+                fps,
+            ),
+        ),
+    ):
+        start_time = time.perf_counter()
+        entries = run()
+        print(
+            f"{name}: {time.perf_counter() - start_time:.3f}s,"
+            + f" {len(entries)} entries"
+        )
+
+
+if __name__ == "__main__":
+    main()
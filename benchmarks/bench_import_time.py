@@ -0,0 +1,62 @@
+"""Benchmark the cold-start import time of the pipeline, eager vs lazy activation.
+
+Each import runs in a new interpreter, with `LAZY_ACTIVATION` set to 0 (schemas
+activated on import) and to 1 (schemas activated on first attribute access).
+
+    python benchmarks/bench_import_time.py [--repeat 3]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+MODULE_NAMES = ("workflow_calcium_imaging.pipeline", "workflow_calcium_imaging.ingest")
+
+
+def import_time(module_name, lazy_activation):
+    """Cold-start import time of a module in a new interpreter.
+
+    Returns:
+        import_time (float): Import time in seconds.
+        imports_imaging (bool): Whether element_calcium_imaging was imported.
+    """
+    script = (
+        "import sys, time\n"
+        + "start_time = time.perf_counter()\n"
+        + f"import {module_name}\n"
+        + "print(time.perf_counter() - start_time)\n"
+        + "print('element_calcium_imaging' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        env={**os.environ, "LAZY_ACTIVATION": str(int(lazy_activation))},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    return float(output[-2]), output[-1] == "True"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    for module_name in MODULE_NAMES:
+        eager_time = min(
+            import_time(module_name, lazy_activation=False)[0]
+            for _ in range(args.repeat)
+        )
+        lazy_time = min(
+            import_time(module_name, lazy_activation=True)[0]
+            for _ in range(args.repeat)
+        )
+        print(
+            f"import {module_name}: {eager_time:.2f}s (eager) vs"
+            + f" {lazy_time:.2f}s (lazy activation)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark the ROI quality metrics of analysis.ROIQualityMetrics, without a database.
+
+Compares `masks.compute_mask_roundness` and `quality_metrics.compute_trace_metrics`
+with the per-ROI loop of imaging.ProcessingQualityMetrics, on synthetic data.
+
+    python benchmarks/bench_quality_metrics.py [--rois 10000] [--frames 2000]
+"""
+
+import argparse
+import time
+
+import numpy as np
+from scipy.stats import skew
+
+from workflow_calcium_imaging.masks import build_mask_matrix, compute_mask_roundness
+from workflow_calcium_imaging.quality_metrics import compute_trace_metrics
+
+
+def synthetic_rois(nrois, nframes, image_shape=(1, 512, 512), seed=0):
+    """Elliptical masks of random size and orientation, and sparse transient traces."""
+    rng = np.random.default_rng(seed)
+    _, height, width = image_shape
+    mask_xpix, mask_ypix, mask_weights = [], [], []
+    for _ in range(nrois):
+        radius_x, radius_y = rng.uniform(1.5, 6, 2)
+        angle = rng.uniform(0, np.pi)
+        y0, x0 = rng.integers(6, height - 6), rng.integers(6, width - 6)
+        dy, dx = np.mgrid[-6:7, -6:7].reshape(2, -1)
+        u = dx * np.cos(angle) + dy * np.sin(angle)
+        v = -dx * np.sin(angle) + dy * np.cos(angle)
+        inside = (u / radius_x) ** 2 + (v / radius_y) ** 2 <= 1
+        mask_xpix.append(x0 + dx[inside])
+        mask_ypix.append(y0 + dy[inside])
+        mask_weights.append(rng.uniform(0.1, 1, inside.sum()))
+    mask_zpix = [np.zeros(len(xpix), dtype=int) for xpix in mask_xpix]
+
+    transients = rng.random((nrois, nframes)) < 0.01
+    kernel = np.exp(-np.arange(30) / 8)
+    traces = np.apply_along_axis(np.convolve, 1, transients, kernel)[:, :nframes]
+    traces = 100 + 50 * traces + rng.standard_normal((nrois, nframes))
+    return (mask_xpix, mask_ypix, mask_zpix, mask_weights), traces.astype(np.float32)
+
+
+def roundness_loop(mask_xpix, mask_ypix, mask_weights):
+    """Per-mask computation of imaging.ProcessingQualityMetrics.Mask roundness."""
+    return np.array(
+        [
+            np.real(eigvals.mean() / eigvals.max())
+            for eigvals in (
+                np.linalg.eigvals(np.cov(x, y, aweights=w))
+                for x, y, w in zip(mask_xpix, mask_ypix, mask_weights)
+            )
+        ]
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rois", type=int, default=10000)
+    parser.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    image_shape = (1, 512, 512)
+    (xpix, ypix, zpix, weights), traces = synthetic_rois(
+        args.rois, args.frames, image_shape
+    )
+    mask_matrix = build_mask_matrix(xpix, ypix, zpix, weights, image_shape)
+
+    t0 = time.perf_counter()
+    roundness = compute_mask_roundness(mask_matrix, image_shape)
+    skewness, variance, snr = compute_trace_metrics(traces)
+    vectorized_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    loop_roundness = roundness_loop(xpix, ypix, weights)
+    loop_skewness = np.array([skew(trace) for trace in traces])
+    loop_std = np.array([trace.std() for trace in traces])
+    loop_time = time.perf_counter() - t0
+
+    print(
+        f"ROI quality metrics: {vectorized_time:.3f}s (vectorized) vs"
+        + f" {loop_time:.3f}s (per-ROI loop) for {traces.shape} ROIs x frames"
+    )
+    np.testing.assert_allclose(roundness, loop_roundness, rtol=1e-5)
+    np.testing.assert_allclose(skewness, loop_skewness, rtol=1e-3, atol=1e-5)
+    np.testing.assert_allclose(np.sqrt(variance), loop_std, rtol=1e-4)
+    assert np.isfinite(snr).all()
+
+
+if __name__ == "__main__":
+    main()
@@ -36,4 +36,9 @@ setup(
     keywords="neuroscience datajoint calcium-imaging",
     packages=find_packages(exclude=["contrib", "docs", "tests*"]),
     install_requires=requirements,
+    entry_points={
+        "console_scripts": [
+            "workflow-calcium-imaging-ingest=workflow_calcium_imaging.ingest:main",
+        ],
+    },
 )
@@ -72,6 +72,7 @@ def pipeline():
         "subject": pipeline.subject,
         "lab": pipeline.lab,
         "imaging": pipeline.imaging,
+        "analysis": pipeline.analysis,
         "scan": pipeline.scan,
         "session": pipeline.session,
         "Equipment": pipeline.Equipment,
@@ -841,3 +842,56 @@ def curations(processing, pipeline):
     if _tear_down:
         with verbose_context:
             imaging.Curation.delete()
+
+
+@pytest.fixture
+def activity_alignment_conditions(pipeline):
+    """Alignment conditions of the demo session, with the trials of `./user_data`.
+
+    Run the `demo_prepare.ipynb` notebook, prior to using this fixture.
+    """
+    from workflow_calcium_imaging import pipeline as workflow_pipeline
+    from workflow_calcium_imaging.ingest import ingest_alignment, ingest_events
+
+    imaging = pipeline["imaging"]
+    analysis = pipeline["analysis"]
+    session_key = dict(subject="subject1", session_datetime="2023-05-11 12:00:00")
+
+    # the trials and events of ./user_data, moved to the demo session
+    csv_paths = {}
+    for name in ("behavior_recordings", "blocks", "trials", "events"):
+        user_data = pd.read_csv(f"./user_data/{name}.csv", dtype=str)
+        user_data = user_data.assign(**session_key)
+        csv_paths[name] = test_user_data_dir / f"{name}.csv"
+        user_data.to_csv(csv_paths[name], index=False)
+
+    with verbose_context:
+        ingest_events(*csv_paths.values(), verbose=False)
+        ingest_alignment(verbose=False)
+        imaging.Activity.populate(session_key)
+
+    trial_keys = (
+        workflow_pipeline.trial.Trial & session_key & "trial_type = 'ctrl'"
+    ).fetch("KEY")
+    condition_keys = [
+        dict(
+            activity_key,
+            alignment_name="center_button",
+            trial_condition="ctrl_center_button",
+        )
+        for activity_key in (imaging.Activity & session_key).fetch("KEY")
+    ]
+    for condition_key in condition_keys:
+        analysis.ActivityAlignmentCondition.insert1(condition_key, skip_duplicates=True)
+        analysis.ActivityAlignmentCondition.Trial.insert(
+            [{**condition_key, **trial_key} for trial_key in trial_keys],
+            skip_duplicates=True,
+        )
+
+    yield condition_keys
+
+    if _tear_down:
+        with verbose_context:
+            (analysis.ActivityAlignmentCondition & condition_keys).delete()
+            for csv_path in csv_paths.values():
+                csv_path.unlink()
@@ -0,0 +1,240 @@
+import warnings
+
+import numpy as np
+
+from workflow_calcium_imaging.alignment import align_trials, get_alignment_start_indices
+
+
+def _align_trials_loop(activity_traces, start_indices, nsamples):
+    """Per-trial reference implementation of `align_trials`."""
+    aligned_activities = []
+    for alignment_start_idx in start_indices:
+        roi_aligned_activities = np.full(
+            (activity_traces.shape[0], nsamples), np.nan, dtype=float
+        )
+        for sample_idx in range(nsamples):
+            frame_idx = alignment_start_idx + sample_idx
+            if 0 <= frame_idx < activity_traces.shape[1]:
+                roi_aligned_activities[:, sample_idx] = activity_traces[:, frame_idx]
+        aligned_activities.append(roi_aligned_activities)
+    return np.stack(aligned_activities)
+
+
+def _synthetic_session(nrois, ntrials, nframes, frame_rate=30.0, seed=0):
+    rng = np.random.default_rng(seed)
+    activity_traces = rng.standard_normal((nrois, nframes))
+    event_times = np.sort(rng.uniform(0, nframes / frame_rate, ntrials))
+    return activity_traces, event_times
+
+
+def test_align_trials():
+    activity_traces, event_times = _synthetic_session(20, 50, 3000)
+    # include windows that run off either end of the recording
+    event_times = np.concatenate([[0.5, 3000 / 30.0 - 0.5], event_times])
+    start_indices = get_alignment_start_indices(event_times, 2.0, 30.0)
+    nsamples = 150
+
+    aligned_activities = align_trials(activity_traces, start_indices, nsamples)
+
+    assert aligned_activities.shape == (52, 20, 150)
+    np.testing.assert_array_equal(
+        aligned_activities,
+        _align_trials_loop(activity_traces, start_indices, nsamples),
+    )
+    assert np.isnan(aligned_activities[0, :, :45]).all()
+    assert np.isnan(aligned_activities[1, :, -45:]).all()
+
+
+def test_iter_aligned_trial_activities():
+    from workflow_calcium_imaging.analysis import _iter_aligned_trial_activities
+
+    activity_traces, event_times = _synthetic_session(7, 10, 600)
+    start_indices = get_alignment_start_indices(event_times, 1.0, 30.0)
+    trial_keys = [{"trial_id": trial_id} for trial_id in range(10)]
+    trace_keys = [{"mask": mask} for mask in range(7)]
+
+    def align(trials, rois):
+        return align_trials(activity_traces[rois], start_indices[trials], 60)
+
+    batches = list(_iter_aligned_trial_activities({}, trial_keys, trace_keys, align, 5))
+
+    assert all(len(batch) <= 5 for batch in batches)
+    rows = [row for batch in batches for row in batch]
+    assert len(rows) == 70
+    np.testing.assert_array_equal(
+        rows[8]["aligned_trace"],
+        align_trials(activity_traces, start_indices, 60)[1, 1],
+    )
+
+
+def test_iter_aligned_roi_activities():
+    from workflow_calcium_imaging.analysis import _iter_aligned_roi_activities
+
+    activity_traces, event_times = _synthetic_session(7, 10, 600)
+    start_indices = get_alignment_start_indices(event_times, 1.0, 30.0)
+    trial_keys = [{"trial_id": trial_id} for trial_id in range(10)]
+    trace_keys = [{"mask": mask} for mask in range(7)]
+
+    def align(trials, rois):
+        return align_trials(activity_traces[rois], start_indices[trials], 60)
+
+    rows = [
+        row
+        for batch in _iter_aligned_roi_activities({}, trial_keys, trace_keys, align, 30)
+        for row in batch
+    ]
+
+    assert len(rows) == 7
+    assert rows[2]["aligned_traces"].shape == (10, 60)
+    assert rows[2]["aligned_traces"].dtype == np.float32
+    np.testing.assert_array_equal(
+        rows[2]["aligned_traces"],
+        align_trials(activity_traces, start_indices, 60)[:, 2].astype(np.float32),
+    )
+
+
+def test_lru_cache():
+    from workflow_calcium_imaging.utils import LRUCache
+
+    cache = LRUCache(max_bytes=2 * 800)
+    for idx in range(3):
+        cache.put(idx, ([], np.zeros(100)))
+    assert 0 not in cache and 1 in cache and 2 in cache
+
+    assert cache.get(1) is not None
+    assert cache.get(0) is None
+    cache.put(3, ([], np.zeros(100)))
+    assert 2 not in cache and 1 in cache
+    assert cache.info() == dict(
+        hits=1, misses=1, entries=2, nbytes=1600, max_bytes=1600
+    )
+
+
+def test_activity_trace_cache(tmp_path, monkeypatch):
+    from workflow_calcium_imaging import analysis
+
+    cache = analysis._activity_trace_cache
+    monkeypatch.setattr(cache, "max_bytes", 0)
+    cache.clear()
+
+    np.save(tmp_path / "traces.npy", np.zeros((10, 100), dtype=np.float32))
+    memmap_traces = np.load(tmp_path / "traces.npy", mmap_mode="r")
+    cache.put("memmap", ([], memmap_traces))
+    cache.put("in_memory", ([], np.zeros(100)))
+    assert len(cache) == 0  # caching is disabled
+
+    # memory-mapped matrices are charged the size of their file
+    cache.max_bytes = memmap_traces.nbytes + 800
+    cache.put("memmap", ([], memmap_traces))
+    cache.put("in_memory", ([], np.zeros(100)))
+    assert cache.nbytes == memmap_traces.nbytes + 800
+    cache.put("in_memory_2", ([], np.zeros(100)))
+    assert "memmap" not in cache and "in_memory" in cache and "in_memory_2" in cache
+    assert analysis.activity_trace_cache_info()["entries"] == 2
+    cache.clear()
+
+
+def test_interpolate_trials():
+    from workflow_calcium_imaging.alignment import interpolate_trials
+
+    frame_rate, nframes = 10.0, 200
+    # two planes sampled half a frame apart, traces linear in time
+    frame_times = np.arange(nframes) / frame_rate + np.array([[0.0], [0.05]])
+    roi_groups = np.array([0, 1, 1])
+    activity_traces = frame_times[roi_groups] * np.array([[1.0], [2.0], [3.0]])
+    event_times = np.array([0.5, 10.0, 19.9])
+    aligned_timestamps = np.arange(-1.0, 1.0, 0.04)
+
+    aligned_activities = interpolate_trials(
+        activity_traces, frame_times, event_times, aligned_timestamps, roi_groups
+    )
+
+    assert aligned_activities.shape == (3, 3, 50)
+    sample_times = event_times[:, None] + aligned_timestamps
+    for roi, slope in enumerate([1.0, 2.0, 3.0]):
+        group_times = frame_times[roi_groups[roi]]
+        valid = (sample_times >= group_times[0]) & (sample_times <= group_times[-1])
+        np.testing.assert_allclose(
+            aligned_activities[:, roi][valid], slope * sample_times[valid]
+        )
+        assert np.isnan(aligned_activities[:, roi][~valid]).all()
+
+
+def test_nan_welford():
+    from workflow_calcium_imaging.alignment import nan_welford
+
+    rng = np.random.default_rng(0)
+    aligned_activities = rng.standard_normal((40, 5, 30))
+    aligned_activities[:3, :, :10] = np.nan
+    aligned_activities[-1, 2, -5:] = np.nan
+    aligned_activities[:, 4, 0] = np.nan
+
+    mean, sem, count = nan_welford(aligned_activities)
+
+    np.testing.assert_array_equal(count, (~np.isnan(aligned_activities)).sum(axis=0))
+    with warnings.catch_warnings():  # all-NaN sample
+        warnings.simplefilter("ignore", RuntimeWarning)
+        np.testing.assert_allclose(mean, np.nanmean(aligned_activities, axis=0))
+        np.testing.assert_allclose(
+            sem,
+            np.nanstd(aligned_activities, axis=0, ddof=1) / np.sqrt(count),
+        )
+
+
+def test_trial_averaged_traces():
+    from workflow_calcium_imaging.analysis import _get_trial_averaged_traces
+
+    rng = np.random.default_rng(0)
+    aligned_activities = rng.standard_normal((10, 3, 30))
+    trace_keys = [{"mask": mask, "fluo_channel": 0} for mask in range(3)]
+
+    rows = _get_trial_averaged_traces(
+        {}, ((trace_keys, trial) for trial in aligned_activities)
+    )
+    assert [{k: row[k] for k in ("mask", "fluo_channel")} for row in rows] == (
+        trace_keys
+    )
+    np.testing.assert_allclose(rows[1]["trial_mean"], aligned_activities[:, 1].mean(0))
+    np.testing.assert_array_equal(rows[1]["trial_count"], 10)
+
+    # alignments without trials or ROIs have no trial-averaged traces
+    assert _get_trial_averaged_traces({}, iter([])) == []
+    assert _get_trial_averaged_traces({}, iter([([], np.empty((0, 30)))] * 2)) == []
+
+
+def test_bin_activities():
+    from workflow_calcium_imaging.alignment import bin_activities
+
+    frame_rate, bin_size = 30.0, 0.1
+    aligned_timestamps = np.arange(-1.0, 1.0, 1 / frame_rate)
+    rng = np.random.default_rng(0)
+    aligned_activities = rng.standard_normal((4, 3, len(aligned_timestamps)))
+    aligned_activities[0, 0, :5] = np.nan
+
+    binned_activities, bin_timestamps = bin_activities(
+        aligned_activities, aligned_timestamps, bin_size
+    )
+
+    assert binned_activities.shape == (4, 3, len(bin_timestamps))
+    np.testing.assert_allclose(bin_timestamps, np.arange(-0.95, 1.0, 0.1))
+    # 3 frames per bin, with bin edges on the event
+    bin_indices = np.floor_divide(np.arange(-30, 30), 3)
+    for bin_idx, bin_index in enumerate(np.unique(bin_indices)):
+        with warnings.catch_warnings():  # all-NaN bin
+            warnings.simplefilter("ignore", RuntimeWarning)
+            expected = np.nanmean(
+                aligned_activities[..., bin_indices == bin_index], axis=-1
+            )
+        np.testing.assert_allclose(binned_activities[..., bin_idx], expected)
+
+
+def test_bin_activities_without_samples():
+    from workflow_calcium_imaging.alignment import bin_activities
+
+    binned_activities, bin_timestamps = bin_activities(
+        np.empty((4, 3, 0), dtype=np.float32), np.empty(0), 0.1
+    )
+
+    assert binned_activities.shape == (4, 3, 0)
+    assert binned_activities.dtype == np.float32
+    assert bin_timestamps.shape == (0,)
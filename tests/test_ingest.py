@@ -1,6 +1,10 @@
+import datetime
+import os
 import pathlib
 import sys
+from types import SimpleNamespace
 
+import pytest
 from element_interface.utils import find_full_path, find_root_directory
 
 from . import (
@@ -115,3 +119,146 @@ def test_paramset_insert(
         " with CaImAn using default CaImAn parameters for 3d volumetric images"
     )
     assert dict_to_uuid(caiman3D_paramset) == paramset_hash
+
+
+def test_validate_csvs(tmp_path):
+    from workflow_calcium_imaging.ingest import validate_csvs
+
+    csvs = validate_csvs("./user_data")
+    assert csvs["trials"] == (str(pathlib.Path("./user_data") / "trials.csv"), 40)
+
+    (tmp_path / "sessions.csv").write_text("subject\nsubject1\n")
+    with pytest.raises(
+        ValueError, match=r"sessions\.csv: missing column\(s\) session_dir"
+    ) as excinfo:
+        validate_csvs(tmp_path)
+    excinfo.match(r"subjects\.csv: file not found")
+
+
+def test_read_csv_chunks():
+    from workflow_calcium_imaging.ingest import read_csv_chunks
+
+    chunks = list(read_csv_chunks("./user_data/events.csv", chunksize=20))
+
+    assert [len(chunk) for chunk in chunks] == [20, 20, 12]
+    assert chunks[0]["trial_id"].dtype == "Int64"
+    assert chunks[0]["event_start_time"].dtype == "float64"
+    assert chunks[0]["event_type"].iloc[0] == "center"
+
+
+def test_read_csv_chunks_missing_values(tmp_path):
+    from workflow_calcium_imaging.ingest import read_csv_chunks
+
+    csv_path = tmp_path / "trials.csv"
+    csv_path.write_text(
+        "subject,trial_id,block_id,trial_type,trial_start_time\n"
+        + "subject1,1,,stim,0.5\n"
+        + "subject1,2,1,,\n"
+    )
+    (chunk,) = read_csv_chunks(csv_path)
+
+    assert chunk["block_id"].dtype == "Int64"
+    assert chunk["block_id"].isna().tolist() == [True, False]
+    assert chunk["trial_type"].tolist() == ["stim", ""]
+    assert chunk["trial_start_time"].isna().tolist() == [False, True]
+
+
+class _Table:
+    """Table with a primary key, refusing duplicate entries like `insert`."""
+
+    def __init__(self, primary_key, secondary_attributes=()):
+        self.primary_key = list(primary_key)
+        self.heading = SimpleNamespace(
+            names=self.primary_key + list(secondary_attributes)
+        )
+        self.table_name = "table"
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def insert(self, rows, skip_duplicates=True, **kwargs):
+        for row in rows.to_dict("records"):
+            key = tuple(row[col] for col in self.primary_key)
+            if key in self.entries and not skip_duplicates:
+                raise ValueError(f"Duplicate entry {key}")
+            self.entries.setdefault(key, row)
+
+
+def test_insert_csv_chunks_without_skip_duplicates(capsys):
+    from workflow_calcium_imaging.ingest import insert_csv_chunks
+
+    event_types = _Table(["event_type"])
+    events = _Table(
+        ["subject", "session_datetime", "event_type", "event_start_time"], ["trial_id"]
+    )
+    insert_csv_chunks(
+        "./user_data/events.csv",
+        [event_types, events],
+        chunksize=10,
+        skip_duplicates=False,
+    )
+
+    assert sorted(event_types.entries) == [("center",), ("left",), ("right",)]
+    assert len(events) == 52
+    assert "Insert 3 entry(s) into table" in capsys.readouterr().out
+
+    # entries already in the table are still reported
+    with pytest.raises(ValueError, match="Duplicate entry"):
+        insert_csv_chunks(
+            "./user_data/events.csv", [event_types], skip_duplicates=False
+        )
+
+
+def test_session_manifest(tmp_path):
+    from workflow_calcium_imaging.ingest import (
+        SessionManifest,
+        _get_dir_signature,
+        _locate_session,
+    )
+
+    sess_dir = tmp_path / "root" / "subject1" / "session1"
+    sess_dir.mkdir(parents=True)
+    (sess_dir / "scan_00001.tif").write_bytes(b"0" * 10)
+    os.utime(sess_dir, ns=(1, 1))
+    assert _get_dir_signature(sess_dir) == (1, 10, 1)
+
+    sess = {"subject": "subject1", "session_dir": "subject1/session1"}
+    located_session = _locate_session(sess, [tmp_path / "root"], {})
+    assert not located_session["is_unchanged"]
+    assert located_session["acq_software"] == "ScanImage"
+
+    session_info = dict(
+        located_session,
+        recording_time=datetime.datetime(2023, 5, 11, 12, 0, 0),
+        scanner="scanner1",
+    )
+    manifest_path = tmp_path / "manifest.sqlite"
+    manifest = SessionManifest(manifest_path)
+    manifest.update([session_info])
+    manifest.close()
+
+    manifest = SessionManifest(manifest_path)
+    manifest_entries = manifest.fetch()
+    manifest.close()
+    assert manifest_entries == {
+        sess_dir.as_posix(): dict(
+            subject="subject1",
+            acq_software="ScanImage",
+            recording_time=datetime.datetime(2023, 5, 11, 12, 0, 0),
+            scanner="scanner1",
+            dir_signature=(1, 10, 1),
+        )
+    }
+
+    # unchanged sessions are taken from the manifest, without listing scan files
+    located_session = _locate_session(sess, [tmp_path / "root"], manifest_entries)
+    assert located_session["is_unchanged"]
+    assert located_session["scanner"] == "scanner1"
+    assert "scan_filepaths" not in located_session
+
+    # a new file changes the signature of the directory
+    (sess_dir / "scan_00002.tif").write_bytes(b"0" * 10)
+    located_session = _locate_session(sess, [tmp_path / "root"], manifest_entries)
+    assert not located_session["is_unchanged"]
+    assert len(located_session["scan_filepaths"]) == 2
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from workflow_calcium_imaging.masks import (
+    build_mask_matrix,
+    compute_mask_iou,
+    compute_pair_correlations,
+    compute_pair_iou,
+    extract_traces,
+    find_nearby_mask_pairs,
+    project_masks,
+    rasterize_masks,
+)
+
+
+def _synthetic_masks(nmasks, image_shape, seed=0):
+    rng = np.random.default_rng(seed)
+    depth, height, width = image_shape
+    mask_xpix, mask_ypix, mask_zpix, mask_weights = [], [], [], []
+    for _ in range(nmasks):
+        y0, x0 = rng.integers(0, height - 5), rng.integers(0, width - 5)
+        ypix, xpix = np.mgrid[y0 : y0 + 5, x0 : x0 + 5].reshape(2, -1)
+        mask_xpix.append(xpix)
+        mask_ypix.append(ypix)
+        mask_zpix.append(np.full(len(xpix), rng.integers(0, depth)))
+        mask_weights.append(rng.uniform(0.1, 1, len(xpix)))
+    return mask_xpix, mask_ypix, mask_zpix, mask_weights
+
+
+def test_mask_matrix():
+    image_shape = (2, 30, 40)
+    mask_xpix, mask_ypix, mask_zpix, mask_weights = _synthetic_masks(50, image_shape)
+    mask_ids = np.arange(50) * 2
+
+    mask_matrix = build_mask_matrix(
+        mask_xpix, mask_ypix, mask_zpix, mask_weights, image_shape
+    )
+    assert mask_matrix.shape == (50, 2 * 30 * 40)
+
+    # rasterization
+    mask_image = np.zeros(image_shape[1:], dtype=bool)
+    label_image = np.full(image_shape[1:], -1)
+    for mask_id, xpix, ypix, zpix in zip(mask_ids, mask_xpix, mask_ypix, mask_zpix):
+        if zpix[0] == 1:
+            mask_image[ypix, xpix] = True
+            label_image[ypix, xpix] = np.maximum(label_image[ypix, xpix], mask_id)
+    np.testing.assert_array_equal(
+        rasterize_masks(mask_ids, mask_matrix, image_shape, plane=1), mask_image
+    )
+    np.testing.assert_array_equal(
+        rasterize_masks(mask_ids, mask_matrix, image_shape, plane=1, labels=True),
+        label_image,
+    )
+
+    # intersection over union
+    iou = compute_mask_iou(mask_matrix).toarray()
+    pixels = [set(zip(z, y, x)) for x, y, z in zip(mask_xpix, mask_ypix, mask_zpix)]
+    for i in range(50):
+        for j in range(50):
+            expected = len(pixels[i] & pixels[j]) / len(pixels[i] | pixels[j])
+            assert np.isclose(iou[i, j], expected)
+
+    # trace extraction
+    frames = np.random.default_rng(1).standard_normal((20, *image_shape))
+    traces = extract_traces(mask_matrix, frames)
+    for i, (xpix, ypix, zpix, weights) in enumerate(
+        zip(mask_xpix, mask_ypix, mask_zpix, mask_weights)
+    ):
+        np.testing.assert_allclose(
+            traces[i],
+            (frames[:, zpix, ypix, xpix] * weights).sum(axis=1) / weights.sum(),
+            rtol=1e-5,
+            atol=1e-6,
+        )
+
+
+def test_get_mask_image(monkeypatch):
+    from workflow_calcium_imaging import masks
+
+    image_shape = (1, 30, 40)
+    mask_matrix = build_mask_matrix(*_synthetic_masks(10, image_shape), image_shape)
+    mask_ids = np.arange(10) * 2
+    monkeypatch.setattr(
+        masks, "get_mask_matrix", lambda key: (mask_ids, mask_matrix, image_shape)
+    )
+
+    np.testing.assert_array_equal(
+        masks.get_mask_image({}, masks=[4, 18], labels=True),
+        rasterize_masks(
+            mask_ids[[2, 9]], mask_matrix[[2, 9]], image_shape, labels=True
+        ),
+    )
+    # mask IDs not in the segmentation are not replaced by a neighbouring mask
+    for missing_masks in ([3], [4, 20], [-1]):
+        with pytest.raises(ValueError, match="not in the segmentation"):
+            masks.get_mask_image({}, masks=missing_masks)
+
+
+def test_duplicate_mask_pairs():
+    rng = np.random.default_rng(2)
+    centers = rng.uniform(0, 100, (300, 2))
+    pairs, distances = find_nearby_mask_pairs(centers, max_distance=7.5)
+
+    all_distances = np.linalg.norm(centers[:, None] - centers[None], axis=2)
+    expected_pairs = np.argwhere(np.triu(all_distances <= 7.5, k=1))
+    order = np.lexsort(pairs.T[::-1])
+    np.testing.assert_array_equal(pairs[order], expected_pairs)
+    np.testing.assert_allclose(distances[order], all_distances[tuple(expected_pairs.T)])
+
+    image_shape = (2, 30, 40)
+    mask_matrix = build_mask_matrix(*_synthetic_masks(50, image_shape), image_shape)
+    projected_masks = project_masks(mask_matrix, image_shape)
+    mask_pairs = np.argwhere(np.triu(np.ones((50, 50), dtype=bool), k=1))
+    np.testing.assert_allclose(
+        compute_pair_iou(projected_masks, mask_pairs),
+        compute_mask_iou(projected_masks).toarray()[tuple(mask_pairs.T)],
+    )
+
+    traces = rng.standard_normal((50, 200))
+    np.testing.assert_allclose(
+        compute_pair_correlations(traces, mask_pairs, batch_size=100),
+        np.corrcoef(traces)[tuple(mask_pairs.T)],
+        atol=1e-5,
+    )
@@ -0,0 +1,101 @@
+import json
+import os
+
+import datajoint as dj
+import pytest
+
+from workflow_calcium_imaging import paths
+
+
+@pytest.fixture
+def root_index(tmp_path, monkeypatch):
+    """Empty root directory index persisted in tmp_path, and two root directories."""
+    root_index_path = tmp_path / "root_index.json"
+    monkeypatch.setitem(
+        dj.config,
+        "custom",
+        {**dj.config.get("custom", {}), "root_index_path": str(root_index_path)},
+    )
+    monkeypatch.setattr(paths, "_root_index", None)
+    monkeypatch.setattr(paths, "_root_index_dirty", False)
+
+    roots = [tmp_path / "root_a", tmp_path / "root_b"]
+    for root_dir in roots:
+        root_dir.mkdir()
+    return root_index_path, roots
+
+
+def test_find_full_path_cached(root_index):
+    root_index_path, (root_a, root_b) = root_index
+    (root_b / "subject1" / "session1").mkdir(parents=True)
+
+    stats = paths.get_root_index_stats()
+    full_path = paths.find_full_path_cached([root_a, root_b], "subject1/session1")
+    assert full_path == root_b / "subject1" / "session1"
+    assert paths.get_root_index_stats()["misses"] == stats["misses"] + 1
+
+    # the root is remembered, and found without probing
+    full_path = paths.find_full_path_cached([root_a, root_b], "subject1/session1")
+    assert full_path == root_b / "subject1" / "session1"
+    assert paths.get_root_index_stats()["hits"] == stats["hits"] + 1
+    assert paths.find_root_directory_cached([root_a, root_b], full_path) == root_b
+
+    # new entries are only written by flush_root_index
+    assert not root_index_path.exists()
+    paths.flush_root_index()
+    assert json.loads(root_index_path.read_text()) == {
+        "subject1/session1": root_b.as_posix()
+    }
+
+    with pytest.raises(FileNotFoundError):
+        paths.find_full_path_cached([root_a, root_b], "subject1/missing")
+
+
+def test_find_full_path_cached_stale_index(root_index):
+    root_index_path, (root_a, root_b) = root_index
+    (root_a / "subject1" / "session1").mkdir(parents=True)
+    paths.find_full_path_cached([root_a, root_b], "subject1/session1")
+    paths.flush_root_index()
+
+    # the session directory moved to another root: the roots are probed again
+    (root_a / "subject1").rename(root_b / "subject1")
+    paths._root_index = None  # reloaded from the file, as in a new process
+    stats = paths.get_root_index_stats()
+    full_path = paths.find_full_path_cached([root_a, root_b], "subject1/session1")
+
+    assert full_path == root_b / "subject1" / "session1"
+    assert paths.get_root_index_stats()["misses"] == stats["misses"] + 1
+    paths.flush_root_index()
+    assert json.loads(root_index_path.read_text()) == {
+        "subject1/session1": root_b.as_posix()
+    }
+
+
+def test_index_session_dir(tmp_path):
+    paths.clear_file_index()
+    sess_dir = tmp_path / "session1"
+    sess_dir.mkdir()
+    (sess_dir / "scan_00001.tif").touch()
+    (sess_dir / "notes.txt").touch()
+    os.utime(sess_dir, ns=(1, 1))
+
+    files = paths._index_session_dir(sess_dir)
+    assert files == {
+        ".tif": [(sess_dir / "scan_00001.tif").as_posix()],
+        ".txt": [(sess_dir / "notes.txt").as_posix()],
+    }
+
+    # the listing is reused while the directory is unmodified
+    (sess_dir / "scan_00002.tif").touch()
+    os.utime(sess_dir, ns=(1, 1))
+    assert paths._index_session_dir(sess_dir) is files
+
+    # and listed again once its modification time changes
+    os.utime(sess_dir, ns=(2, 2))
+    assert sorted(paths._index_session_dir(sess_dir)[".tif"]) == [
+        (sess_dir / "scan_00001.tif").as_posix(),
+        (sess_dir / "scan_00002.tif").as_posix(),
+    ]
+
+    paths.clear_file_index()
+    assert not paths._file_index
@@ -1,4 +1,9 @@
-from . import dj_config, pipeline
+import datetime
+import os
+import subprocess
+import sys
+
+from . import dj_config, pipeline, verbose_context
 
 
 def test_generate_pipeline(pipeline):
@@ -19,3 +24,73 @@ def test_generate_pipeline(pipeline):
     assert equipment_tbl.full_table_name == Equipment.full_table_name
     assert "mask_npix" in imaging.Segmentation.Mask.heading.secondary_attributes
     assert "activity_trace" in imaging.Activity.Trace.heading.secondary_attributes
+
+
+def test_scheduler_table_order(pipeline):
+    from workflow_calcium_imaging.scheduler import get_populate_tables
+
+    table_names = list(get_populate_tables())
+
+    assert table_names.index("scan.ScanInfo") < table_names.index("imaging.Processing")
+    assert table_names.index("imaging.Processing") < table_names.index(
+        "imaging.MotionCorrection"
+    )
+    assert table_names.index("imaging.Activity") < table_names.index(
+        "analysis.ActivityAlignment"
+    )
+
+
+def test_scheduler_run(pipeline):
+    """
+    Assert scheduler.run populates the pending keys of the pipeline.
+    Run the `demo_prepare.ipynb` notebook, prior to running this test.
+    """
+    from workflow_calcium_imaging import scheduler
+
+    analysis = pipeline["analysis"]
+    key = dict(
+        subject="subject1",
+        session_datetime=datetime.datetime(2023, 5, 11, 12, 00, 00),
+        scan_id=0,
+        paramset_idx=0,
+        curation_id=0,
+    )
+    with verbose_context:
+        (analysis.ROIQualityMetrics & key).delete()
+
+    report = scheduler.run(key, n_workers=2, requery_interval=0.1, verbose=False)
+
+    assert analysis.ROIQualityMetrics & key
+    roi_metrics_tasks = [
+        task for task in report if task["table"] == "analysis.ROIQualityMetrics"
+    ]
+    assert [task["status"] for task in roi_metrics_tasks] == ["success"]
+    assert roi_metrics_tasks[0]["key"] == (analysis.ROIQualityMetrics & key).fetch1(
+        "KEY"
+    )
+    # completed keys are not populated again
+    report = scheduler.run(key, n_workers=2, verbose=False)
+    assert not [
+        task for task in report if task["table"] == "analysis.ROIQualityMetrics"
+    ]
+
+
+def test_lazy_activation():
+    """Importing the pipeline with lazy activation does not import the elements.
+
+    The import times are compared by `benchmarks/bench_import_time.py`.
+    """
+    script = (
+        "import sys\n"
+        + "import workflow_calcium_imaging.pipeline\n"
+        + "import workflow_calcium_imaging.ingest\n"
+        + "print('element_calcium_imaging' in sys.modules)\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script],
+        env={**os.environ, "LAZY_ACTIVATION": "1"},
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+    assert output[-1] == "False"
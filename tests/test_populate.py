@@ -2,7 +2,11 @@ import shutil
 import datetime
 import pytest
 
+import datajoint as dj
+import numpy as np
+
 from . import (
+    activity_alignment_conditions,
     caiman2D_paramset,
     caiman3D_paramset,
     curations,
@@ -471,3 +475,165 @@ def test_imaging_quality_metrics_populate(pipeline):
     assert round(mask_metrics["roundness"], 2) == 0.75
     assert round(trace_metrics["skewness"], 2) == 2.29
     assert round(trace_metrics["variance"], 2) == 865.22
+
+
+def test_roi_quality_metrics_populate(pipeline):
+    """
+    Assert ROIQualityMetrics agrees with imaging.ProcessingQualityMetrics.
+    Run the `demo_prepare.ipynb` notebook, prior to running this test.
+    """
+    imaging = pipeline["imaging"]
+    analysis = pipeline["analysis"]
+
+    key = dict(
+        subject="subject1",
+        session_datetime=datetime.datetime(2023, 5, 11, 12, 00, 00),
+        scan_id=0,
+        paramset_idx=0,
+        curation_id=0,
+    )
+
+    with verbose_context:
+        imaging.ProcessingQualityMetrics.populate(key)
+        analysis.ROIQualityMetrics.populate_batch(key, batch_size=1)
+
+    assert analysis.ROIQualityMetrics & key
+    assert len(analysis.ROIQualityMetrics.Trace & key) == len(
+        imaging.Fluorescence.Trace & key
+    )
+
+    mask_key = dict(key, mask=0)
+    roi_metrics = (analysis.ROIQualityMetrics.Trace & mask_key).fetch(
+        limit=1, as_dict=True
+    )[0]
+    trace_metrics = (
+        imaging.ProcessingQualityMetrics.Trace
+        & dict(mask_key, fluo_channel=roi_metrics["fluo_channel"])
+    ).fetch1()
+    assert round(roi_metrics["roundness"], 2) == 0.75
+    assert round(roi_metrics["skewness"], 2) == round(trace_metrics["skewness"], 2)
+    # imaging.ProcessingQualityMetrics.Trace stores the standard deviation
+    assert round(roi_metrics["variance"] ** 0.5, 2) == round(
+        trace_metrics["variance"], 2
+    )
+
+
+def test_activity_alignment_populate_parallel(pipeline, activity_alignment_conditions):
+    """
+    Assert ActivityAlignment.populate_parallel agrees with a serial populate.
+    Run the `demo_prepare.ipynb` notebook, prior to running this test.
+    """
+    analysis = pipeline["analysis"]
+    condition_keys = activity_alignment_conditions
+
+    def fetch_aligned_traces():
+        return (analysis.ActivityAlignment.AlignedTrialActivity & condition_keys).fetch(
+            "KEY", "aligned_trace", order_by="trial_id, mask, fluo_channel"
+        )
+
+    with verbose_context:
+        (analysis.ActivityAlignment & condition_keys).delete()
+        report = analysis.ActivityAlignment.populate_parallel(
+            condition_keys, n_workers=2, verbose=False
+        )
+    assert len(report) == len(condition_keys)
+    assert all(result["status"] == "success" for result in report)
+    parallel_keys, parallel_traces = fetch_aligned_traces()
+    assert len(parallel_keys)
+
+    # completed keys are not populated again
+    assert analysis.ActivityAlignment.populate_parallel(condition_keys) == []
+
+    with verbose_context:
+        (analysis.ActivityAlignment & condition_keys).delete()
+        analysis.ActivityAlignment.populate(condition_keys)
+    serial_keys, serial_traces = fetch_aligned_traces()
+
+    assert list(parallel_keys) == list(serial_keys)
+    for parallel_trace, serial_trace in zip(parallel_traces, serial_traces):
+        np.testing.assert_array_equal(parallel_trace, serial_trace)
+
+
+def test_fetch_aligned_activities(pipeline, activity_alignment_conditions, tmp_path):
+    """
+    Assert the aligned activities fetched and rendered in batch agree with each ROI.
+    Run the `demo_prepare.ipynb` notebook, prior to running this test.
+    """
+    analysis = pipeline["analysis"]
+    key = activity_alignment_conditions[0]
+
+    with verbose_context:
+        analysis.ActivityAlignment.populate(key)
+
+    alignment = analysis.ActivityAlignment()
+    (fluo_channel, *_) = alignment.get_fluo_channels(key)
+    masks, trial_ids, aligned_activities = alignment.fetch_aligned_activities(key)
+    assert len(masks) == len(
+        analysis.ActivityAlignment.AlignedTrialActivity
+        & key
+        & {"fluo_channel": fluo_channel, "trial_id": trial_ids[0]}
+    )
+    roi_trial_ids, roi_aligned_traces = alignment.get_aligned_activities(key, masks[1])
+    np.testing.assert_array_equal(trial_ids, roi_trial_ids)
+    np.testing.assert_array_equal(aligned_activities[1], roi_aligned_traces)
+
+    rois, _, _ = alignment.fetch_aligned_activities(key, rois=masks[:3])
+    np.testing.assert_array_equal(rois, masks[:3])
+
+    filepaths = alignment.plot_aligned_activities_batch(
+        key, tmp_path, rois=masks[:3], n_workers=2
+    )
+    assert list(filepaths) == list(masks[:3])
+    assert all(filepath.stat().st_size for filepath in filepaths.values())
+    # existing images are skipped
+    mtimes = [filepath.stat().st_mtime_ns for filepath in filepaths.values()]
+    alignment.plot_aligned_activities_batch(key, tmp_path, rois=masks[:3])
+    assert [filepath.stat().st_mtime_ns for filepath in filepaths.values()] == mtimes
+
+
+def test_populate_stats(pipeline, monkeypatch):
+    """
+    Assert the make calls of instrumented tables are recorded in stats.PopulateStats.
+    Run the `demo_prepare.ipynb` notebook, prior to running this test.
+    """
+    from workflow_calcium_imaging import db_prefix, stats
+
+    analysis = pipeline["analysis"]
+
+    key = dict(
+        subject="subject1",
+        session_datetime=datetime.datetime(2023, 5, 11, 12, 00, 00),
+        scan_id=0,
+        paramset_idx=0,
+        curation_id=0,
+    )
+
+    stats.activate(db_prefix + "workflow_stats")
+    # restore the original make once the test completes
+    monkeypatch.setattr(
+        analysis.ROIQualityMetrics, "make", analysis.ROIQualityMetrics.make
+    )
+    stats.instrument(analysis)
+    stats.instrument(analysis)  # instrumented tables are left unchanged
+    assert analysis.ROIQualityMetrics.make._instrumented
+
+    table_restriction = dict(table_name="analysis.ROIQualityMetrics")
+    with verbose_context:
+        (stats.PopulateStats & table_restriction).delete_quick()
+        (analysis.ROIQualityMetrics & key).delete()
+        analysis.ROIQualityMetrics.populate(key)
+
+    populate_stats = (stats.PopulateStats & table_restriction).fetch1()
+    assert populate_stats["key"] == (analysis.ROIQualityMetrics & key).fetch1("KEY")
+    assert populate_stats["key_hash"] == dj.key_hash(populate_stats["key"])
+    assert populate_stats["wall_time"] > 0
+    assert populate_stats["bytes_fetched"] > 0
+    assert populate_stats["bytes_inserted"] > 0
+
+    report = stats.get_report(table_restriction)
+    assert list(report.index) == ["analysis.ROIQualityMetrics"]
+    assert report.loc["analysis.ROIQualityMetrics", "count"] == 1
+    assert report.loc["analysis.ROIQualityMetrics", "wall_time_p50"] == (
+        pytest.approx(populate_stats["wall_time"])
+    )
+    assert {"cpu_time_p95", "peak_rss_p50", "bytes_fetched_p50"} <= set(report.columns)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from workflow_calcium_imaging.previews import (
+    MoviePreview,
+    PreviewStore,
+    downsample_traces,
+)
+
+
+def test_preview_store(tmp_path):
+    store = PreviewStore(tmp_path)
+    key = {"subject": "subject1", "scan_id": 0}
+    image = np.arange(12.0).reshape(3, 4)
+
+    assert store.get("summary_images", key) is None
+    content_hash = store.put("summary_images", key, average_image=image)
+    np.testing.assert_array_equal(
+        store.get("summary_images", key)["average_image"], image
+    )
+    # identical content is stored once
+    assert store.put("summary_images", {**key, "scan_id": 1}, average_image=image) == (
+        content_hash
+    )
+    assert len(list((tmp_path / "objects").rglob("*.npz"))) == 1
+
+
+def test_movie_preview():
+    rng = np.random.default_rng(0)
+    movie = rng.integers(0, 4096, (1003, 34, 40)).astype(np.int16)
+
+    movie_preview = MoviePreview(len(movie), max_frames=100, spatial_factor=4)
+    for start in range(0, len(movie), 64):
+        movie_preview.add(movie[start : start + 64])
+    preview = movie_preview.result()
+
+    assert preview.shape == (92, 8, 10)  # 91 bins of 11 frames and 2 frames
+    np.testing.assert_allclose(
+        preview[0], movie[:11, :32, :40].reshape(11, 8, 4, 10, 4).mean(axis=(0, 2, 4))
+    )
+    np.testing.assert_allclose(
+        preview[-1], movie[1001:, :32].reshape(2, 8, 4, 10, 4).mean(axis=(0, 2, 4))
+    )
+
+
+def test_downsample_traces():
+    traces = np.arange(20.0).reshape(2, 10)
+
+    np.testing.assert_array_equal(
+        downsample_traces(traces, 4), [[1, 4, 7, 9], [11, 14, 17, 19]]
+    )
+    np.testing.assert_array_equal(
+        downsample_traces(traces, 4, reduce=np.maximum),
+        [[2, 5, 8, 9], [12, 15, 18, 19]],
+    )
@@ -0,0 +1,32 @@
+import numpy as np
+from scipy.stats import skew
+
+from benchmarks.bench_quality_metrics import roundness_loop, synthetic_rois
+from workflow_calcium_imaging.masks import build_mask_matrix, compute_mask_roundness
+from workflow_calcium_imaging.quality_metrics import compute_trace_metrics
+
+
+def test_roi_quality_metrics():
+    image_shape = (1, 128, 128)
+    (xpix, ypix, zpix, weights), traces = synthetic_rois(200, 500, image_shape)
+
+    roundness = compute_mask_roundness(
+        build_mask_matrix(xpix, ypix, zpix, weights, image_shape), image_shape
+    )
+    np.testing.assert_allclose(
+        roundness, roundness_loop(xpix, ypix, weights), rtol=1e-5
+    )
+
+    skewness, variance, snr = compute_trace_metrics(traces, rows_per_chunk=64)
+    np.testing.assert_allclose(skewness, skew(traces.astype(float), axis=1), rtol=1e-6)
+    np.testing.assert_allclose(variance, traces.astype(float).var(axis=1), rtol=1e-6)
+    np.testing.assert_allclose(
+        snr,
+        traces.std(axis=1) / (np.diff(traces, axis=1).std(axis=1) / np.sqrt(2)),
+        rtol=1e-2,
+    )
+    # white noise has a signal-to-noise ratio of about 1
+    _, _, noise_snr = compute_trace_metrics(
+        np.random.default_rng(1).standard_normal((10, 10000))
+    )
+    np.testing.assert_allclose(noise_snr, 1, atol=0.05)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from workflow_calcium_imaging.scan_metrics import compute_frame_metrics
+
+
+def test_compute_frame_metrics():
+    rng = np.random.default_rng(0)
+    movie = rng.integers(0, 4096, (1003, 32, 40)).astype(np.int16)
+
+    metrics = compute_frame_metrics(
+        lambda start, stop: movie[start:stop], len(movie), chunk_size=64, n_workers=3
+    )
+
+    np.testing.assert_array_equal(metrics["min_intensity"], movie.min(axis=(1, 2)))
+    np.testing.assert_allclose(metrics["mean_intensity"], movie.mean(axis=(1, 2)))
+    np.testing.assert_array_equal(metrics["max_intensity"], movie.max(axis=(1, 2)))
+    np.testing.assert_allclose(
+        metrics["contrast"],
+        np.percentile(movie, 99, axis=(1, 2)) - np.percentile(movie, 1, axis=(1, 2)),
+    )
+
+
+def test_compute_frame_metrics_without_frames():
+    metrics = compute_frame_metrics(lambda start, stop: np.empty((0, 32, 40)), 0)
+
+    assert all(len(metrics[name]) == 0 for name in metrics)
+    assert set(metrics) == {
+        "min_intensity",
+        "mean_intensity",
+        "max_intensity",
+        "contrast",
+    }
@@ -14,4 +14,9 @@ dj.config["custom"]["imaging_root_data_dir"] = os.getenv(
     "IMAGING_ROOT_DATA_DIR", dj.config["custom"].get("imaging_root_data_dir", "")
 )
 
+# activate the schemas of `pipeline` on first access to their attributes
+dj.config["custom"]["lazy_activation"] = str(
+    os.getenv("LAZY_ACTIVATION", dj.config["custom"].get("lazy_activation", False))
+).lower() in ("1", "true")
+
 db_prefix = dj.config["custom"].get("database.prefix", "")
\ No newline at end of file
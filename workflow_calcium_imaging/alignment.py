@@ -0,0 +1,216 @@
+"""Array routines used by the `analysis` schema to align activity traces to events."""
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def get_alignment_start_indices(event_times, min_limit, frame_rate):
+    """Compute the first frame index of the alignment window of every trial.
+
+    Args:
+        event_times (np.ndarray): (s) Alignment event time of each trial.
+        min_limit (float): (s) Duration of the window preceding the event.
+        frame_rate (float): (Hz) Sampling rate of the activity traces.
+
+    Returns:
+        start_indices (np.ndarray): Start frame index of each trial (truncated towards
+            zero, as `int()` does).
+    """
+    event_times = np.asarray(event_times, dtype=float)
+    return ((event_times - min_limit) * frame_rate).astype(int)
+
+
+def align_trials(activity_traces, start_indices, nsamples):
+    """Gather the alignment window of every trial for all ROIs at once.
+
+    Samples falling outside of the recording are filled with NaN.
+
+    Args:
+        activity_traces (np.ndarray): (ROIs x frames) activity traces.
+        start_indices (np.ndarray): Start frame index of each trial.
+        nsamples (int): Number of samples in the alignment window.
+
+    Returns:
+        aligned_activities (np.ndarray): (trials x ROIs x samples) aligned activity.
+    """
+    start_indices = np.asarray(start_indices, dtype=int)
+    nrois, nframes = activity_traces.shape
+    dtype = np.result_type(activity_traces.dtype, np.float32)
+
+    # Trials whose window lies entirely within the recording are gathered from a
+    # strided view of the traces; only the others need per-sample bounds checks.
+    inbound = (start_indices >= 0) & (start_indices + nsamples <= nframes)
+    if nsamples and inbound.any():
+        windows = sliding_window_view(activity_traces, nsamples, axis=1).transpose(
+            1, 0, 2
+        )
+        if inbound.all():
+            return windows[start_indices].astype(dtype, copy=False)
+
+    aligned_activities = np.full(
+        (len(start_indices), nrois, nsamples), np.nan, dtype=dtype
+    )
+    if not nsamples:
+        return aligned_activities
+    if inbound.any():
+        aligned_activities[inbound] = windows[start_indices[inbound]]
+
+    outbound = np.flatnonzero(~inbound)
+    if len(outbound):
+        sample_indices = start_indices[outbound, None] + np.arange(nsamples)
+        valid = (sample_indices >= 0) & (sample_indices < nframes)
+        trial_indices, window_indices = np.nonzero(valid)
+        aligned_activities[
+            outbound[trial_indices], :, window_indices
+        ] = activity_traces[:, sample_indices[valid]].T
+
+    return aligned_activities
+
+
+def interpolate_trials(
+    activity_traces, frame_times, event_times, aligned_timestamps, roi_groups=None
+):
+    """Linearly interpolate the activity of every trial onto a common time grid.
+
+    ROIs may be sampled at different times (e.g. the planes of a volumetric scan); each
+    ROI is then assigned to a group of `frame_times`. Samples outside of the recording
+    are filled with NaN.
+
+    Args:
+        activity_traces (np.ndarray): (ROIs x frames) activity traces.
+        frame_times (np.ndarray): (s) Acquisition time of each frame, either shared by
+            all ROIs (frames,) or per group of ROIs (groups x frames). Must be
+            increasing.
+        event_times (np.ndarray): (s) Alignment event time of each trial.
+        aligned_timestamps (np.ndarray): (s) Sample times relative to the event.
+        roi_groups (np.ndarray): Optional. Row of `frame_times` of each ROI. Required
+            when `frame_times` is 2-dimensional.
+
+    Returns:
+        aligned_activities (np.ndarray): (trials x ROIs x samples) aligned activity.
+    """
+    frame_times = np.atleast_2d(frame_times)
+    if roi_groups is None:
+        roi_groups = np.zeros(activity_traces.shape[0], dtype=int)
+    roi_groups = np.asarray(roi_groups, dtype=int)
+
+    # (trials x samples)
+    sample_times = (
+        np.asarray(event_times, dtype=float)[:, None]
+        + np.asarray(aligned_timestamps, dtype=float)[None, :]
+    )
+    dtype = np.result_type(activity_traces.dtype, np.float32)
+    aligned_activities = np.full(
+        (sample_times.shape[0], activity_traces.shape[0], sample_times.shape[1]),
+        np.nan,
+        dtype=dtype,
+    )
+
+    for group in np.unique(roi_groups):
+        group_times = frame_times[group]
+        group_rois = np.flatnonzero(roi_groups == group)
+        right_idx = np.clip(
+            np.searchsorted(group_times, sample_times, side="right"),
+            1,
+            len(group_times) - 1,
+        )
+        left_idx = right_idx - 1
+        left_times, right_times = group_times[left_idx], group_times[right_idx]
+        weights = (sample_times - left_times) / np.where(
+            right_times > left_times, right_times - left_times, np.inf
+        )
+        valid = (sample_times >= group_times[0]) & (sample_times <= group_times[-1])
+
+        group_traces = activity_traces[group_rois]
+        # (ROIs x trials x samples) -> (trials x ROIs x samples)
+        interpolated = (
+            group_traces[:, left_idx] * (1 - weights)
+            + group_traces[:, right_idx] * weights
+        )
+        interpolated[:, ~valid] = np.nan
+        aligned_activities[:, group_rois] = interpolated.transpose(1, 0, 2)
+
+    return aligned_activities
+
+
+def nan_welford(trial_activities):
+    """Mean and standard error across trials, in a single streaming pass.
+
+    Uses Welford's online algorithm, updated one trial at a time. NaN samples (e.g.
+    the padding of trials near the edges of the recording) are excluded from the
+    statistics of their sample only.
+
+    Args:
+        trial_activities (iterable): Aligned activity of one trial at a time, e.g.
+            (ROIs x samples) arrays.
+
+    Returns:
+        mean (np.ndarray): Mean across trials of each sample.
+        sem (np.ndarray): Standard error of the mean of each sample (NaN with fewer
+            than 2 trials).
+        count (np.ndarray): Number of trials with a value at each sample.
+    """
+    count = mean = m2 = None
+    for trial_activity in trial_activities:
+        trial_activity = np.asarray(trial_activity, dtype=float)
+        if count is None:
+            count = np.zeros(trial_activity.shape, dtype=int)
+            mean = np.zeros(trial_activity.shape)
+            m2 = np.zeros(trial_activity.shape)
+
+        valid = ~np.isnan(trial_activity)
+        count += valid
+        delta = np.where(valid, trial_activity - mean, 0.0)
+        mean += np.divide(delta, count, out=np.zeros_like(delta), where=valid)
+        m2 += np.where(valid, delta * (trial_activity - mean), 0.0)
+
+    if count is None:
+        raise ValueError("No trial to average")
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(count > 0, mean, np.nan)
+        sem = np.where(
+            count > 1, np.sqrt(m2 / np.maximum(count - 1, 1) / count), np.nan
+        )
+    return mean, sem, count
+
+
+def bin_activities(aligned_activities, aligned_timestamps, bin_size):
+    """Average aligned activity in time bins.
+
+    Bin edges are multiples of `bin_size` relative to the event. NaN samples are
+    excluded from the average of their bin; bins without a valid sample are NaN.
+    Without samples, there are no bins.
+
+    Args:
+        aligned_activities (np.ndarray): (... x samples) aligned activity.
+        aligned_timestamps (np.ndarray): (s) Increasing sample times relative to the
+            event.
+        bin_size (float): (s) Duration of each bin.
+
+    Returns:
+        binned_activities (np.ndarray): (... x bins) mean activity of each bin.
+        bin_timestamps (np.ndarray): (s) Center time of each bin relative to the event.
+    """
+    aligned_activities = np.asarray(aligned_activities)
+    if not len(aligned_timestamps):
+        binned_activities = np.full(
+            aligned_activities.shape[:-1] + (0,),
+            np.nan,
+            dtype=np.result_type(aligned_activities, np.float32),
+        )
+        return binned_activities, np.empty(0)
+
+    # tolerate rounding errors of timestamps lying on a bin edge
+    bin_indices = np.floor(np.asarray(aligned_timestamps) / bin_size + 1e-9).astype(int)
+    bin_starts = np.flatnonzero(np.diff(bin_indices, prepend=bin_indices[0] - 1))
+
+    valid = ~np.isnan(aligned_activities)
+    sums = np.add.reduceat(np.where(valid, aligned_activities, 0), bin_starts, axis=-1)
+    counts = np.add.reduceat(valid, bin_starts, axis=-1, dtype=int)
+    binned_activities = np.divide(
+        sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0
+    ).astype(sums.dtype, copy=False)
+
+    bin_timestamps = (bin_indices[bin_starts] + 0.5) * bin_size
+    return binned_activities, bin_timestamps
@@ -1,13 +1,44 @@
+import hashlib
 import importlib
 import inspect
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 
 import datajoint as dj
 import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from .alignment import (
+    align_trials,
+    bin_activities,
+    get_alignment_start_indices,
+    interpolate_trials,
+    nan_welford,
+)
+from .masks import (
+    compute_mask_roundness,
+    compute_pair_correlations,
+    compute_pair_iou,
+    find_nearby_mask_pairs,
+    get_mask_matrix,
+    project_masks,
+    set_linking_module,
+)
+from .quality_metrics import compute_trace_metrics
+from .utils import LRUCache, get_peak_rss, init_populate_worker, populate_key
+
+logger = dj.logger
 
 schema = dj.schema()
 
 _linking_module = None
 
+_activity_trace_cache = LRUCache(max_bytes=0)
+
 
 def activate(
     schema_name, *, create_schema=True, create_tables=True, linking_module=None
@@ -33,6 +64,7 @@ def activate(
 
     global _linking_module
     _linking_module = linking_module
+    set_linking_module(linking_module)
 
     schema.activate(
         schema_name,
@@ -42,6 +74,166 @@ def activate(
     )
 
 
+@schema
+class DuplicateMaskCriteria(dj.Lookup):
+    """Criteria to flag pairs of masks as duplicates of the same ROI.
+
+    Attributes:
+        duplicate_criteria_id (int): Unique ID of the criteria.
+        max_center_distance (float): Maximum distance (in pixels) between the centers
+            of the masks of a pair.
+        iou_threshold (float): Minimum intersection over union of the pixels of the
+            masks, projected on the imaging plane.
+        correlation_threshold (float): Minimum correlation of the activity traces.
+        criteria_description (str): Optional. Description. Default is ''.
+    """
+
+    definition = """
+    duplicate_criteria_id: smallint
+    ---
+    max_center_distance: float  # (pixels) between the centers of the masks
+    iou_threshold: float  # of the masks projected on the imaging plane
+    correlation_threshold: float  # of the activity traces
+    criteria_description='': varchar(1000)
+    """
+    contents = [(0, 10.0, 0.5, 0.8, "default")]
+
+
+@schema
+class DuplicateMask(dj.Computed):
+    """Masks of an imaging.Activity entry that duplicate another mask.
+
+    Only pairs of masks whose centers are within `max_center_distance` are compared,
+    using a grid index of the mask centers. Masks of different planes are compared
+    through their projection on the imaging plane.
+
+    Attributes:
+        imaging.Activity (foreign key): Primary key from imaging.Activity.
+        DuplicateMaskCriteria (foreign key): Primary key from DuplicateMaskCriteria.
+    """
+
+    definition = """
+    -> imaging.Activity
+    -> DuplicateMaskCriteria
+    """
+
+    class Pair(dj.Part):
+        """Overlapping pair of nearby masks.
+
+        Attributes:
+            DuplicateMask (foreign key): Primary key from DuplicateMask.
+            imaging.Segmentation.Mask (foreign key): Primary key from
+                imaging.Segmentation.Mask.
+            paired_mask (int): Mask overlapping `mask`, with a higher ID.
+            iou (float): Intersection over union of the projected masks.
+            trace_correlation (float): Correlation of the activity traces.
+            center_distance (float): Distance (in pixels) between the mask centers.
+        """
+
+        definition = """
+        -> master
+        -> imaging.Segmentation.Mask
+        -> imaging.Segmentation.Mask.proj(paired_mask='mask')
+        ---
+        iou: float  # of the masks projected on the imaging plane
+        trace_correlation=null: float  # of the activity traces
+        center_distance: float  # (pixels)
+        """
+
+    class Duplicate(dj.Part):
+        """Mask flagged as a duplicate, to be excluded from analyses.
+
+        Attributes:
+            DuplicateMask (foreign key): Primary key from DuplicateMask.
+            imaging.Segmentation.Mask (foreign key): Primary key from
+                imaging.Segmentation.Mask.
+            kept_mask (int): Mask kept among the group of duplicated masks (the one
+                with the most pixels).
+        """
+
+        definition = """
+        -> master
+        -> imaging.Segmentation.Mask
+        ---
+        kept_mask: smallint  # mask kept among the group of duplicated masks
+        """
+
+    def make(self, key):
+        max_center_distance, iou_threshold, correlation_threshold = (
+            DuplicateMaskCriteria & key
+        ).fetch1("max_center_distance", "iou_threshold", "correlation_threshold")
+
+        mask_ids, mask_matrix, image_shape = get_mask_matrix(key)
+        center_x, center_y, mask_npix = (
+            _linking_module.imaging.Segmentation.Mask & key
+        ).fetch("mask_center_x", "mask_center_y", "mask_npix", order_by="mask")
+        trace_keys, activity_traces = get_activity_traces(key)
+
+        # compare the masks with an activity trace (of the first channel)
+        trace_masks, trace_rows = np.unique(
+            [trace_key["mask"] for trace_key in trace_keys], return_index=True
+        )
+        mask_rows = np.flatnonzero(np.isin(mask_ids, trace_masks))
+        mask_ids, mask_npix = mask_ids[mask_rows], mask_npix[mask_rows]
+        centers = np.stack([center_x[mask_rows], center_y[mask_rows]], axis=1)
+
+        pairs, center_distances = find_nearby_mask_pairs(centers, max_center_distance)
+        iou = compute_pair_iou(
+            project_masks(mask_matrix[mask_rows], image_shape), pairs
+        )
+        overlapping = iou > 0
+        pairs, center_distances, iou = (
+            pairs[overlapping],
+            center_distances[overlapping],
+            iou[overlapping],
+        )
+        trace_correlations = compute_pair_correlations(
+            activity_traces[trace_rows[np.searchsorted(trace_masks, mask_ids)]], pairs
+        )
+
+        # keep the largest mask of each group of pairwise duplicated masks
+        duplicated = (iou >= iou_threshold) & (
+            trace_correlations >= correlation_threshold
+        )
+        _, groups = connected_components(
+            sparse.csr_matrix(
+                (np.ones(duplicated.sum()), tuple(pairs[duplicated].T)),
+                shape=(len(mask_ids), len(mask_ids)),
+            ),
+            directed=False,
+        )
+        group_sizes = np.bincount(groups)
+        duplicates = []
+        for group in np.flatnonzero(group_sizes > 1):
+            members = np.flatnonzero(groups == group)
+            kept = members[np.argmax(mask_npix[members])]
+            duplicates.extend(
+                dict(key, mask=mask_ids[member], kept_mask=mask_ids[kept])
+                for member in members
+                if member != kept
+            )
+
+        self.insert1(key)
+        self.Pair.insert(
+            dict(
+                key,
+                mask=mask_ids[i],
+                paired_mask=mask_ids[j],
+                iou=pair_iou,
+                trace_correlation=None if np.isnan(correlation) else correlation,
+                center_distance=distance,
+            )
+            for (i, j), pair_iou, correlation, distance in zip(
+                pairs, iou, trace_correlations, center_distances
+            )
+        )
+        self.Duplicate.insert(duplicates)
+        logger.info(
+            f"Flagged {len(duplicates)} duplicate(s) among {len(mask_ids)} masks"
+            + f" from {len(pairs)} overlapping nearby pair(s)"
+        )
+
+
 @schema
 class ActivityAlignmentCondition(dj.Manual):
     """Activity alignment condition.
@@ -52,6 +244,21 @@ class ActivityAlignmentCondition(dj.Manual):
         trial_condition (str): User-friendly name of condition.
         condition_description (str). Optional. Description. Default is ''.
         bin_size (float): bin-size (in second) used to compute the PSTH,
+        storage_mode (str): Storage of the aligned activity, either one entry per
+            (trial, ROI) in `ActivityAlignment.AlignedTrialActivity` ("trial") or one
+            (trials x samples) matrix per ROI in
+            `ActivityAlignment.AlignedROIActivity` ("roi"). Default is "trial".
+        alignment_method (str): Conversion of event times to samples, either by frame
+            index at the scan frame rate ("frame_index"), or by linear interpolation of
+            each ROI's activity at the acquisition time of its frames, accounting for
+            per-plane offsets of volumetric scans ("frame_times"). Default is
+            "frame_index".
+        sampling (str): Sampling of the stored aligned activity, either at the scan
+            frame rate ("frame") or averaged in bins of `bin_size` ("bin"). Default is
+            "frame".
+        DuplicateMaskCriteria (foreign key): Optional. Criteria of the DuplicateMask
+            entry whose duplicated masks are excluded from the alignment. Default is
+            None, aligning all masks.
     """
 
     definition = """
@@ -61,6 +268,10 @@ class ActivityAlignmentCondition(dj.Manual):
     ---
     condition_description='': varchar(1000)
     bin_size=0.04: float # bin-size (in second) used to compute the PSTH
+    storage_mode="trial": enum("trial", "roi")  # aligned activity per trial or per ROI
+    alignment_method="frame_index": enum("frame_index", "frame_times")
+    sampling="frame": enum("frame", "bin")  # frame rate, or bin_size averages
+    -> [nullable] DuplicateMaskCriteria  # exclude the masks flagged as duplicates
     """
 
     class Trial(dj.Part):
@@ -113,7 +324,37 @@ class ActivityAlignment(dj.Computed):
         aligned_trace: longblob  # (s) Calcium activity aligned to the event time
         """
 
+    class AlignedROIActivity(dj.Part):
+        """Aligned activity of all trials of a ROI.
+
+        Attributes:
+            ActivityAlignment (foreign key): Primary key from ActivityAlignment.
+            imaging.Activity.Trace (foreign key): Primary key from
+                imaging.Activity.Trace.
+            trial_ids (longblob): trial_id of each row of aligned_traces.
+            aligned_traces (longblob): (trials x samples) Calcium activity aligned to
+                the event time (float32).
+        """
+
+        definition = """
+        -> master
+        -> imaging.Activity.Trace
+        ---
+        trial_ids: longblob  # trial_id of each row of aligned_traces
+        aligned_traces: longblob  # (trials x samples) activity aligned to the event time
+        """
+
+    @property
+    def key_source(self):
+        # conditions excluding duplicated masks wait for their DuplicateMask entry
+        return (ActivityAlignmentCondition & "duplicate_criteria_id IS NULL").proj() + (
+            ActivityAlignmentCondition & DuplicateMask
+        ).proj()
+
     def make(self, key):
+        storage_mode, alignment_method, sampling, bin_size = (
+            ActivityAlignmentCondition & key
+        ).fetch1("storage_mode", "alignment_method", "sampling", "bin_size")
         sess_time, scan_time, nframes, frame_rate = (
             _linking_module.scan.ScanInfo * _linking_module.session.Session & key
         ).fetch1("session_datetime", "scan_datetime", "nframes", "fps")
@@ -131,39 +372,236 @@ class ActivityAlignment(dj.Computed):
         aligned_timestamps = np.arange(-min_limit, max_limit, 1 / frame_rate)
         nsamples = len(aligned_timestamps)
 
-        trace_keys, activity_traces = (
-            _linking_module.imaging.Activity.Trace & key
-        ).fetch("KEY", "activity_trace", order_by="mask")
-        activity_traces = np.vstack(activity_traces)
+        trace_keys, activity_traces = get_activity_traces(key)
 
-        aligned_trial_activities = []
-        for _, r in trialized_event_times.iterrows():
-            if r.event is None or np.isnan(r.event):
-                continue
-            alignment_start_idx = int((r.event - min_limit) * frame_rate)
-            roi_aligned_activities = activity_traces[
-                :, alignment_start_idx : (alignment_start_idx + nsamples)
-            ]
-            if roi_aligned_activities.shape[-1] != nsamples:
-                shape_diff = nsamples - roi_aligned_activities.shape[-1]
-                roi_aligned_activities = np.pad(
-                    roi_aligned_activities,
-                    ((0, 0), (0, shape_diff)),
-                    mode="constant",
-                    constant_values=np.nan,
+        duplicate_masks = (
+            DuplicateMask.Duplicate * ActivityAlignmentCondition & key
+        ).fetch("mask")
+        if len(duplicate_masks):
+            kept_rois = np.flatnonzero(
+                ~np.isin(
+                    [trace_key["mask"] for trace_key in trace_keys], duplicate_masks
                 )
+            )
+            trace_keys = [trace_keys[roi] for roi in kept_rois]
+            activity_traces = activity_traces[kept_rois]
 
-            aligned_trial_activities.extend(
-                [
-                    {**key, **r.trial_key, **trace_key, "aligned_trace": aligned_trace}
-                    for trace_key, aligned_trace in zip(
-                        trace_keys, roi_aligned_activities
-                    )
-                ]
+        trialized_event_times = trialized_event_times[
+            trialized_event_times.event.notna()
+        ]
+        event_times = trialized_event_times.event.to_numpy(dtype=float)
+
+        if alignment_method == "frame_times":
+            frame_times, roi_fields = _get_roi_frame_times(
+                key, trace_keys, nframes, frame_rate
+            )
+
+            def align(trials, rois):
+                return interpolate_trials(
+                    activity_traces[rois],
+                    frame_times,
+                    event_times[trials],
+                    aligned_timestamps,
+                    roi_fields[rois],
+                )
+
+        else:
+            start_indices = get_alignment_start_indices(
+                event_times, min_limit, frame_rate
+            )
+
+            def align(trials, rois):
+                return align_trials(
+                    activity_traces[rois], start_indices[trials], nsamples
+                )
+
+        if sampling == "bin":
+            frame_align, frame_timestamps = align, aligned_timestamps
+            _, aligned_timestamps = bin_activities(
+                np.empty((0, nsamples)), frame_timestamps, bin_size
             )
 
+            def align(trials, rois):
+                return bin_activities(
+                    frame_align(trials, rois), frame_timestamps, bin_size
+                )[0]
+
         self.insert1({**key, "aligned_timestamps": aligned_timestamps})
-        self.AlignedTrialActivity.insert(aligned_trial_activities)
+
+        if storage_mode == "roi":
+            part_table, iter_aligned_activities = (
+                self.AlignedROIActivity,
+                _iter_aligned_roi_activities,
+            )
+        else:
+            part_table, iter_aligned_activities = (
+                self.AlignedTrialActivity,
+                _iter_aligned_trial_activities,
+            )
+
+        batch_size = dj.config["custom"].get("alignment_insert_batch_size", 50000)
+        start_time, row_count = time.time(), 0
+        for aligned_activities in iter_aligned_activities(
+            key,
+            list(trialized_event_times.trial_key),
+            trace_keys,
+            align,
+            batch_size,
+        ):
+            part_table.insert(aligned_activities)
+            row_count += len(aligned_activities)
+
+        elapsed = time.time() - start_time
+        peak_rss = get_peak_rss()
+        logger.info(
+            f"Inserted {row_count} {part_table.__name__} entries in {elapsed:.2f}s"
+            + f" ({row_count / max(elapsed, 1e-9):.0f} rows/s"
+            + (f", peak RSS {peak_rss / 1024**2:.0f} MB)" if peak_rss else ")")
+        )
+
+    @classmethod
+    def populate_parallel(cls, *restrictions, n_workers=None, verbose=True):
+        """Populate ActivityAlignment with a pool of worker processes.
+
+        Pending keys are distributed across the workers, each of which holds its own
+        database connection and calls `populate` with `reserve_jobs=True`, so that
+        several nodes may populate the same table concurrently.
+
+        Args:
+            restrictions: Restrictions on the key source, as passed to `populate`.
+            n_workers (int): Number of worker processes. Defaults to the number of
+                CPUs.
+            verbose (bool): Display the wall time of each key. Default True.
+
+        Returns:
+            report (list): One dictionary per key with the key, its `status`
+                ("success", "error" or "reserved" by another process), `wall_time`
+                (s) and `error_message`.
+        """
+        table = cls()
+        keys = ((table.key_source & dj.AndList(restrictions)) - table).fetch("KEY")
+        if not keys:
+            return []
+
+        start_time = time.time()
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=init_populate_worker,
+            initargs=(_linking_module.__name__,),
+        ) as executor:
+            futures = [
+                executor.submit(populate_key, ActivityAlignment, key) for key in keys
+            ]
+            report = []
+            for future in as_completed(futures):
+                result = future.result()
+                report.append(result)
+                if verbose:
+                    print(
+                        f"{result['status']} in {result['wall_time']:.2f}s:"
+                        + f" {result['key']}"
+                    )
+
+        if verbose:
+            print(
+                f"---- Populated {sum(r['status'] == 'success' for r in report)}"
+                + f"/{len(keys)} ActivityAlignment entries in"
+                + f" {time.time() - start_time:.2f}s ----"
+            )
+        return report
+
+    def get_aligned_activities(self, key, roi):
+        """Fetch the event-aligned activity of all trials of a ROI.
+
+        Returns the same trials and traces regardless of the `storage_mode` of the
+        alignment condition.
+
+        Args:
+            key (dict): key of ActivityAlignment master table
+            roi (int): imaging segmentation mask
+
+        Returns:
+            trial_ids (np.ndarray): trial_id of each trial, in ascending order.
+            aligned_traces (np.ndarray): (trials x samples) aligned activity.
+        """
+        storage_mode = (ActivityAlignmentCondition & key).fetch1("storage_mode")
+        if storage_mode == "roi":
+            trial_ids, aligned_traces = (
+                self.AlignedROIActivity & key & {"mask": roi}
+            ).fetch1("trial_ids", "aligned_traces")
+            trial_order = np.argsort(trial_ids, kind="stable")
+            return trial_ids[trial_order], aligned_traces[trial_order]
+
+        trial_ids, aligned_traces = (
+            self.AlignedTrialActivity & key & {"mask": roi}
+        ).fetch("trial_id", "aligned_trace", order_by="trial_id")
+        return trial_ids, np.vstack(aligned_traces)
+
+    def iter_trial_activities(self, key):
+        """Iterate over the event-aligned activity of all ROIs, one trial at a time.
+
+        In the "trial" storage mode, trials are fetched in batches of about
+        `dj.config["custom"]["alignment_insert_batch_size"]` aligned traces.
+
+        Args:
+            key (dict): key of ActivityAlignment master table
+
+        Yields:
+            trace_keys (list): `mask` and `fluo_channel` of each ROI, ordered by
+                mask and fluorescence channel.
+            trial_activities (np.ndarray): (ROIs x samples) aligned activity of one
+                trial.
+        """
+        storage_mode = (ActivityAlignmentCondition & key).fetch1("storage_mode")
+        if storage_mode == "roi":
+            masks, fluo_channels, trial_ids, aligned_traces = (
+                self.AlignedROIActivity & key
+            ).fetch(
+                "mask",
+                "fluo_channel",
+                "trial_ids",
+                "aligned_traces",
+                order_by="mask, fluo_channel",
+            )
+            if not len(masks):
+                return
+            trace_keys = [
+                dict(mask=mask, fluo_channel=fluo_channel)
+                for mask, fluo_channel in zip(masks, fluo_channels)
+            ]
+            # (ROIs x trials x samples)
+            aligned_activities = np.stack(aligned_traces)
+            for trial_idx in np.argsort(trial_ids[0], kind="stable"):
+                yield trace_keys, aligned_activities[:, trial_idx]
+            return
+
+        aligned_trials = self.AlignedTrialActivity & key
+        trial_ids = (dj.U("trial_id") & aligned_trials).fetch(
+            "trial_id", order_by="trial_id"
+        )
+        nrois = (
+            len(aligned_trials & {"trial_id": trial_ids[0]}) if len(trial_ids) else 0
+        )
+        batch_size = dj.config["custom"].get("alignment_insert_batch_size", 50000)
+        trials_per_batch = max(1, batch_size // max(nrois, 1))
+        for batch_start in range(0, len(trial_ids), trials_per_batch):
+            batch_trial_ids = trial_ids[batch_start : batch_start + trials_per_batch]
+            row_trial_ids, masks, fluo_channels, aligned_traces = (
+                aligned_trials & [{"trial_id": t} for t in batch_trial_ids]
+            ).fetch(
+                "trial_id",
+                "mask",
+                "fluo_channel",
+                "aligned_trace",
+                order_by="trial_id, mask, fluo_channel",
+            )
+            for trial_id in batch_trial_ids:
+                trial_rows = np.flatnonzero(row_trial_ids == trial_id)
+                trace_keys = [
+                    dict(mask=masks[row], fluo_channel=fluo_channels[row])
+                    for row in trial_rows
+                ]
+                yield trace_keys, np.vstack(aligned_traces[trial_rows])
 
     def plot_aligned_activities(self, key, roi, axs=None, title=None):
         """Plot event-aligned activities for selected trials, and trial-averaged
@@ -188,33 +626,705 @@ class ActivityAlignment(dj.Computed):
             ax0, ax1 = axs
 
         aligned_timestamps = (self & key).fetch1("aligned_timestamps")
-        trial_ids, aligned_spikes = (
-            self.AlignedTrialActivity & key & {"mask": roi}
-        ).fetch("trial_id", "aligned_trace", order_by="trial_id")
+        trial_ids, aligned_spikes = self.get_aligned_activities(key, roi)
 
-        aligned_spikes = np.vstack(aligned_spikes)
-
-        ax0.imshow(
-            aligned_spikes,
-            cmap="inferno",
-            interpolation="nearest",
-            aspect="auto",
-            extent=(
-                aligned_timestamps[0],
-                aligned_timestamps[-1],
-                0,
-                aligned_spikes.shape[0],
-            ),
+        _draw_aligned_activities(ax0, ax1, aligned_timestamps, aligned_spikes)
+
+        if title:
+            plt.suptitle(title)
+
+        return fig
+
+    def get_fluo_channels(self, key):
+        """Return the fluorescence channels of the aligned activity, in ascending order.
+
+        Args:
+            key (dict): key of ActivityAlignment master table
+
+        Returns:
+            fluo_channels (np.ndarray): fluo_channel of the aligned traces.
+        """
+        return np.unique(
+            np.concatenate(
+                [
+                    (dj.U("fluo_channel") & (part_table & key)).fetch("fluo_channel")
+                    for part_table in (
+                        self.AlignedTrialActivity,
+                        self.AlignedROIActivity,
+                    )
+                ]
+            )
+        ).astype(int)
+
+    def fetch_aligned_activities(self, key, rois=None, fluo_channel=None):
+        """Fetch the event-aligned activity of many ROIs of a channel in a single query.
+
+        Args:
+            key (dict): key of ActivityAlignment master table
+            rois (list): Optional. imaging segmentation masks to fetch. Default is all.
+            fluo_channel (int): Optional. Fluorescence channel to fetch. Default is the
+                first channel of the alignment (see `get_fluo_channels`).
+
+        Returns:
+            masks (np.ndarray): imaging segmentation mask of each ROI, ascending.
+            trial_ids (np.ndarray): trial_id of each trial, ascending.
+            aligned_activities (np.ndarray): (ROIs x trials x samples) aligned
+                activity; NaN for trials without activity.
+        """
+        storage_mode = (ActivityAlignmentCondition & key).fetch1("storage_mode")
+        if fluo_channel is None:
+            fluo_channels = self.get_fluo_channels(key)
+            fluo_channel = fluo_channels[0] if len(fluo_channels) else 0
+        channel_restriction = {"fluo_channel": fluo_channel}
+        roi_restriction = [{"mask": roi} for roi in rois] if rois is not None else {}
+        if storage_mode == "roi":
+            masks, roi_trial_ids, aligned_traces = (
+                self.AlignedROIActivity & key & channel_restriction & roi_restriction
+            ).fetch("mask", "trial_ids", "aligned_traces", order_by="mask")
+        else:
+            row_masks, row_trial_ids, aligned_traces = (
+                self.AlignedTrialActivity & key & channel_restriction & roi_restriction
+            ).fetch("mask", "trial_id", "aligned_trace", order_by="mask, trial_id")
+            masks = np.unique(row_masks)
+            roi_trial_ids = [row_trial_ids[row_masks == mask] for mask in masks]
+            aligned_traces = [
+                np.vstack(aligned_traces[row_masks == mask]) for mask in masks
+            ]
+
+        if not len(masks):
+            return masks, np.array([], dtype=int), np.empty((0, 0, 0))
+
+        trial_ids = np.unique(np.concatenate(roi_trial_ids))
+        aligned_activities = np.full(
+            (len(masks), len(trial_ids), aligned_traces[0].shape[-1]), np.nan
         )
-        ax0.axvline(x=0, linestyle="--", color="white")
-        ax0.set_axis_off()
+        for roi_idx, (roi_trials, roi_traces) in enumerate(
+            zip(roi_trial_ids, aligned_traces)
+        ):
+            aligned_activities[
+                roi_idx, np.searchsorted(trial_ids, roi_trials)
+            ] = roi_traces
+        return masks, trial_ids, aligned_activities
 
-        ax1.plot(aligned_timestamps, np.nanmean(aligned_spikes, axis=0))
-        ax1.axvline(x=0, linestyle="--", color="black")
-        ax1.set_xlabel("Time (s)")
-        ax1.set_xlim(aligned_timestamps[0], aligned_timestamps[-1])
+    def plot_aligned_activities_batch(
+        self,
+        key,
+        output_dir,
+        rois=None,
+        fluo_channel=None,
+        n_workers=None,
+        overwrite=False,
+    ):
+        """Render the event-aligned activities of many ROIs to PNG files.
+
+        Activities are fetched in a single query and rendered by a pool of worker
+        processes with the non-interactive Agg backend, each reusing one figure.
+        Images are stored in a sub-directory of `output_dir` named after the hash of
+        `key`; ROIs whose image already exists are skipped unless `overwrite`.
+
+        Args:
+            key (dict): key of ActivityAlignment master table
+            output_dir (str): Directory in which to save the images.
+            rois (list): Optional. imaging segmentation masks to render. Default is all
+                the masks of the alignment.
+            fluo_channel (int): Optional. Fluorescence channel to render. Default is
+                the first channel of the alignment (see `get_fluo_channels`).
+            n_workers (int): Number of worker processes. Defaults to the number of
+                CPUs.
+            overwrite (bool): Re-render existing images. Default False.
+
+        Returns:
+            filepaths (dict): Path of the image of each ROI.
+        """
+        key = (self & key).fetch1("KEY")
+        image_dir = Path(output_dir) / dj.key_hash(key)
+        image_dir.mkdir(parents=True, exist_ok=True)
+
+        if fluo_channel is None:
+            fluo_channels = self.get_fluo_channels(key)
+            fluo_channel = fluo_channels[0] if len(fluo_channels) else 0
+        channel_restriction = {"fluo_channel": fluo_channel}
+        if rois is None:  # masks of the alignment, without excluded duplicates
+            rois = np.unique(
+                np.concatenate(
+                    [
+                        (dj.U("mask") & (part_table & key & channel_restriction)).fetch(
+                            "mask"
+                        )
+                        for part_table in (
+                            self.AlignedTrialActivity,
+                            self.AlignedROIActivity,
+                        )
+                    ]
+                )
+            )
+        filepaths = {
+            roi: image_dir / f"roi_{roi}_channel_{fluo_channel}.png" for roi in rois
+        }
+        pending_rois = [
+            roi
+            for roi, filepath in filepaths.items()
+            if overwrite or not filepath.exists()
+        ]
+        if not pending_rois:
+            return filepaths
+
+        aligned_timestamps = (self & key).fetch1("aligned_timestamps")
+        masks, _, aligned_activities = self.fetch_aligned_activities(
+            key, pending_rois, fluo_channel
+        )
+        if not len(masks):
+            return filepaths
+
+        n_workers = min(n_workers or os.cpu_count() or 1, len(masks))
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            for _ in executor.map(
+                _render_aligned_activities,
+                [
+                    (
+                        aligned_timestamps,
+                        aligned_activities[worker_idx::n_workers],
+                        [filepaths[mask] for mask in masks[worker_idx::n_workers]],
+                        [f"ROI {mask}" for mask in masks[worker_idx::n_workers]],
+                    )
+                    for worker_idx in range(n_workers)
+                ],
+            ):
+                pass
+
+        return filepaths
+
+
+@schema
+class TrialAveragedActivity(dj.Computed):
+    """Trial-averaged event-aligned activity (PSTH) of each ROI.
+
+    Attributes:
+        ActivityAlignment (foreign key): Primary key from ActivityAlignment.
+    """
+
+    definition = """
+    -> ActivityAlignment
+    """
+
+    class Trace(dj.Part):
+        """Trial-averaged activity of a ROI.
+
+        Attributes:
+            TrialAveragedActivity (foreign key): Primary key from
+                TrialAveragedActivity.
+            imaging.Activity.Trace (foreign key): Primary key from
+                imaging.Activity.Trace.
+            trial_mean (longblob): Mean aligned activity across trials.
+            trial_sem (longblob): Standard error of the mean across trials.
+            trial_count (longblob): Number of trials with activity at each sample.
+        """
+
+        definition = """
+        -> master
+        -> imaging.Activity.Trace
+        ---
+        trial_mean: longblob  # mean aligned activity across trials
+        trial_sem: longblob  # standard error of the mean across trials
+        trial_count: longblob  # number of trials with activity at each sample
+        """
+
+    def make(self, key):
+        # an alignment without trials or ROIs gets an entry without Trace entries
+        self.insert1(key)
+        self.Trace.insert(
+            _get_trial_averaged_traces(
+                key, ActivityAlignment().iter_trial_activities(key)
+            )
+        )
+
+    def plot_psth(self, key, roi, ax=None, title=None):
+        """Plot the trial-averaged activity of a ROI with its standard error.
+
+        Args:
+            key (dict): key of TrialAveragedActivity master table
+            roi (int): imaging segmentation mask
+            ax (matplotlib.ax): optional definition of axes for plot.
+                Default is plt.subplots(1, 1, figsize=(12, 4))
+            title (str): Optional title label
+
+        Returns:
+            fig (matplotlib.pyplot.figure): Figure of the trial-averaged activity.
+        """
+        import matplotlib.pyplot as plt
+
+        fig = None
+        if ax is None:
+            fig, ax = plt.subplots(1, 1, figsize=(12, 4))
+
+        aligned_timestamps = (ActivityAlignment & key).fetch1("aligned_timestamps")
+        trial_mean, trial_sem = (self.Trace & key & {"mask": roi}).fetch1(
+            "trial_mean", "trial_sem"
+        )
+
+        ax.plot(aligned_timestamps, trial_mean)
+        ax.fill_between(
+            aligned_timestamps,
+            trial_mean - trial_sem,
+            trial_mean + trial_sem,
+            alpha=0.3,
+        )
+        ax.axvline(x=0, linestyle="--", color="black")
+        ax.set_xlabel("Time (s)")
+        ax.set_xlim(aligned_timestamps[0], aligned_timestamps[-1])
 
         if title:
-            plt.suptitle(title)
+            ax.set_title(title)
 
         return fig
+
+
+@schema
+class ROIQualityMetrics(dj.Computed):
+    """Quality metrics of the masks and fluorescence traces of a curation.
+
+    The metrics of `imaging.ProcessingQualityMetrics`, and the signal-to-noise ratio,
+    in one row per trace, computed with stacked array operations over the sparse mask
+    matrix and all traces. `populate_batch` computes many curations per query.
+
+    Attributes:
+        imaging.Fluorescence (foreign key): Primary key from imaging.Fluorescence.
+    """
+
+    definition = """
+    -> imaging.Fluorescence
+    """
+
+    class Trace(dj.Part):
+        """Quality metrics of a mask and its fluorescence trace.
+
+        Attributes:
+            ROIQualityMetrics (foreign key): Primary key from ROIQualityMetrics.
+            imaging.Fluorescence.Trace (foreign key): Primary key from
+                imaging.Fluorescence.Trace.
+            roundness (float): Optional. Roundness of the mask between 0.5 and 1.
+                Values closer to 1 are rounder.
+            skewness (float): Optional. Skewness of the fluorescence trace.
+            variance (float): Variance of the fluorescence trace. Note that the
+                `variance` of imaging.ProcessingQualityMetrics.Trace holds the
+                standard deviation.
+            snr (float): Optional. Standard deviation of the fluorescence trace
+                divided by that of its frame-to-frame noise.
+        """
+
+        definition = """
+        -> master
+        -> imaging.Fluorescence.Trace
+        ---
+        roundness=null: float  # of the mask, between 0.5 and 1 (round)
+        skewness=null: float  # of the fluorescence trace
+        variance: float  # of the fluorescence trace
+        snr=null: float  # std of the trace over std of its frame-to-frame noise
+        """
+
+    def make(self, key):
+        (traces,) = compute_roi_quality_metrics([key]).values()
+        self.insert1(key)
+        self.Trace.insert(traces)
+
+    @classmethod
+    def populate_batch(cls, *restrictions, batch_size=None, verbose=True):
+        """Populate ROIQualityMetrics, fetching and computing many curations at once.
+
+        Entries are inserted one transaction per key. Unlike `populate`, keys are not
+        reserved, so only one process should run this at a time.
+
+        Args:
+            restrictions: Restrictions on the key source, as passed to `populate`.
+            batch_size (int): Number of imaging.Fluorescence entries fetched and
+                computed together. Defaults to
+                `dj.config["custom"]["quality_metrics_batch_size"]`, or 20.
+            verbose (bool): Display the progress of each batch. Default True.
+        """
+        table = cls()
+        keys = ((table.key_source & dj.AndList(restrictions)) - table).fetch("KEY")
+        batch_size = batch_size or dj.config["custom"].get(
+            "quality_metrics_batch_size", 20
+        )
+
+        for batch_start in range(0, len(keys), batch_size):
+            start_time = time.time()
+            batch_keys = keys[batch_start : batch_start + batch_size]
+            batch_traces = compute_roi_quality_metrics(batch_keys)
+            for key in batch_keys:
+                with table.connection.transaction:
+                    table.insert1(key, allow_direct_insert=True)
+                    table.Trace.insert(batch_traces[_get_master_key(key)])
+            if verbose:
+                print(
+                    f"Populated {batch_start + len(batch_keys)}/{len(keys)}"
+                    + " ROIQualityMetrics entries ("
+                    + f"{sum(map(len, batch_traces.values()))} traces in"
+                    + f" {time.time() - start_time:.2f}s)"
+                )
+
+
+def _draw_aligned_activities(ax0, ax1, aligned_timestamps, aligned_spikes):
+    """Draw the aligned activity of each trial (ax0) and their mean (ax1)."""
+    ax0.imshow(
+        aligned_spikes,
+        cmap="inferno",
+        interpolation="nearest",
+        aspect="auto",
+        extent=(
+            aligned_timestamps[0],
+            aligned_timestamps[-1],
+            0,
+            aligned_spikes.shape[0],
+        ),
+    )
+    ax0.axvline(x=0, linestyle="--", color="white")
+    ax0.set_axis_off()
+
+    ax1.plot(aligned_timestamps, np.nanmean(aligned_spikes, axis=0))
+    ax1.axvline(x=0, linestyle="--", color="black")
+    ax1.set_xlabel("Time (s)")
+    ax1.set_xlim(aligned_timestamps[0], aligned_timestamps[-1])
+
+
+def _render_aligned_activities(args):
+    """Render the aligned activities of several ROIs to PNG files, reusing a figure."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    aligned_timestamps, aligned_activities, filepaths, titles = args
+    fig, (ax0, ax1) = plt.subplots(2, 1, figsize=(12, 8))
+    for aligned_spikes, filepath, title in zip(aligned_activities, filepaths, titles):
+        ax0.cla()
+        ax1.cla()
+        _draw_aligned_activities(ax0, ax1, aligned_timestamps, aligned_spikes)
+        fig.suptitle(title)
+        fig.savefig(filepath)
+    plt.close(fig)
+
+
+def get_activity_traces(key):
+    """Fetch the (ROIs x frames) activity trace matrix of an imaging.Activity entry.
+
+    Matrices are cached per imaging.Activity key, so that all alignment conditions of
+    a session share a single fetch. The cache holds at most
+    `dj.config["custom"]["activity_trace_cache_size"]` megabytes (default 1024; 0
+    disables caching), memory-mapped matrices included. Cache statistics are returned
+    by `activity_trace_cache_info`.
+
+    When `dj.config["custom"]["alignment_scratch_dir"]` is set, the matrix is instead
+    written once, as float32, to a memory-mapped file in that directory and read from
+    there by every process. The file is named after the imaging.Activity key and a
+    signature of its traces, so it is rebuilt if the entry is recomputed.
+
+    Args:
+        key (dict): Restriction including the primary key of imaging.Activity.
+
+    Returns:
+        trace_keys (list): Primary key from imaging.Activity.Trace of each ROI, ordered
+            by mask and fluorescence channel.
+        activity_traces (np.ndarray): (ROIs x frames) read-only activity traces.
+    """
+    activity = _linking_module.imaging.Activity
+    cache_key = tuple((attr, key[attr]) for attr in activity.primary_key)
+    _activity_trace_cache.max_bytes = (
+        dj.config["custom"].get("activity_trace_cache_size", 1024) * 1024**2
+    )
+
+    cached = _activity_trace_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    scratch_dir = dj.config["custom"].get("alignment_scratch_dir")
+    if scratch_dir:
+        trace_keys, activity_traces = _get_memmap_activity_traces(
+            dict(cache_key), Path(scratch_dir)
+        )
+    else:
+        trace_keys, activity_traces = (activity.Trace & dict(cache_key)).fetch(
+            "KEY", "activity_trace", order_by="mask, fluo_channel"
+        )
+        activity_traces = np.vstack(activity_traces)
+        activity_traces.flags.writeable = False
+
+    _activity_trace_cache.put(cache_key, (trace_keys, activity_traces))
+    return trace_keys, activity_traces
+
+
+def _get_memmap_activity_traces(activity_key, scratch_dir, rois_per_fetch=256):
+    """Activity traces of an imaging.Activity entry as a float32 memory-mapped file.
+
+    The file is created on first use by fetching `rois_per_fetch` traces at a time,
+    so that the full float64 matrix is never held in memory. Its name holds a
+    signature of the trace keys and of the first trace. The file is written under a
+    temporary name and renamed once complete; files of the same imaging.Activity key
+    with another signature, left by a previous computation of the entry, are removed.
+
+    Args:
+        activity_key (dict): Primary key from imaging.Activity.
+        scratch_dir (pathlib.Path): Directory of the memory-mapped files.
+        rois_per_fetch (int): Number of traces fetched per query. Default 256.
+
+    Returns:
+        trace_keys (list): Primary key from imaging.Activity.Trace of each ROI, ordered
+            by mask and fluorescence channel.
+        activity_traces (np.memmap): (ROIs x frames) read-only activity traces.
+    """
+    traces = _linking_module.imaging.Activity.Trace & activity_key
+    trace_keys = traces.fetch("KEY", order_by="mask, fluo_channel")
+    first_trace = (traces & trace_keys[0]).fetch1("activity_trace")
+    signature = dj.key_hash(
+        dict(
+            trace_keys=str([(k["mask"], k["fluo_channel"]) for k in trace_keys]),
+            first_trace=hashlib.sha1(np.ascontiguousarray(first_trace)).hexdigest(),
+        )
+    )
+    key_hash = dj.key_hash(activity_key)
+    filepath = scratch_dir / f"{key_hash}-{signature}.npy"
+    shape = (len(trace_keys), len(first_trace))
+
+    if filepath.exists():
+        activity_traces = np.load(filepath, mmap_mode="r")
+        if activity_traces.shape == shape:
+            return trace_keys, activity_traces
+
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    # write to a temporary file so other processes never open a partial matrix
+    tmp_filepath = filepath.with_suffix(f".{os.getpid()}.tmp")
+    activity_traces = np.lib.format.open_memmap(
+        tmp_filepath, mode="w+", dtype=np.float32, shape=shape
+    )
+    for batch_start in range(0, len(trace_keys), rois_per_fetch):
+        batch_keys = trace_keys[batch_start : batch_start + rois_per_fetch]
+        for roi_idx, activity_trace in enumerate(
+            (traces & batch_keys).fetch(
+                "activity_trace", order_by="mask, fluo_channel"
+            ),
+            start=batch_start,
+        ):
+            activity_traces[roi_idx] = activity_trace
+    activity_traces.flush()
+    del activity_traces
+    os.replace(tmp_filepath, filepath)
+    for stale_filepath in scratch_dir.glob(f"{key_hash}-*.npy"):
+        if stale_filepath.name != filepath.name:
+            stale_filepath.unlink(missing_ok=True)
+
+    return trace_keys, np.load(filepath, mmap_mode="r")
+
+
+def activity_trace_cache_info():
+    """Return hit/miss counts and size of the activity trace cache of this process."""
+    return _activity_trace_cache.info()
+
+
+def compute_roi_quality_metrics(keys):
+    """Compute the ROIQualityMetrics.Trace entries of imaging.Fluorescence entries.
+
+    The traces of all keys are fetched in one query and grouped by number of frames;
+    the masks of each imaging.Segmentation entry are read with
+    `masks.get_mask_matrix`.
+
+    Args:
+        keys (list): Primary keys of imaging.Fluorescence.
+
+    Returns:
+        traces (dict): ROIQualityMetrics.Trace entries of each key, by the tuple of
+            its primary key attributes and values.
+    """
+    fluorescence = _linking_module.imaging.Fluorescence
+    trace_keys, traces = (fluorescence.Trace & keys).fetch("KEY", "fluorescence")
+
+    nframes = np.array([len(trace) for trace in traces])
+    skewness, variance, snr = (np.empty(len(traces)) for _ in range(3))
+    for length in np.unique(nframes):
+        rows = np.flatnonzero(nframes == length)
+        (
+            skewness[rows],
+            variance[rows],
+            snr[rows],
+        ) = compute_trace_metrics(traces[rows])
+
+    rows_by_key = {_get_master_key(key): [] for key in keys}
+    for row, trace_key in enumerate(trace_keys):
+        rows_by_key[_get_master_key(trace_key)].append(row)
+
+    entries = {}
+    for master_key, rows in rows_by_key.items():
+        mask_ids, mask_matrix, image_shape = get_mask_matrix(dict(master_key))
+        roundness = compute_mask_roundness(mask_matrix, image_shape)
+        entries[master_key] = [
+            dict(
+                trace_keys[row],
+                roundness=roundness[np.searchsorted(mask_ids, trace_keys[row]["mask"])],
+                skewness=skewness[row],
+                variance=variance[row],
+                snr=snr[row],
+            )
+            for row in rows
+        ]
+    return entries
+
+
+def _get_master_key(key):
+    """Primary key of imaging.Fluorescence as a tuple of attributes and values."""
+    return tuple(
+        (attr, key[attr]) for attr in _linking_module.imaging.Fluorescence.primary_key
+    )
+
+
+def _get_roi_frame_times(key, trace_keys, nframes, frame_rate):
+    """Acquisition time of the frames of each ROI of an imaging.Activity entry.
+
+    Uses `scan.ScanInfo.Field.frame_times` when the scan schema provides it. Otherwise
+    frames are assumed to be acquired at the scan frame rate, offset by the mean
+    `delay_image` (ms) of their field. ROIs are assigned to fields by the plane of
+    their mask (`mask_center_z`) in volumetric scans, and to the first field otherwise.
+
+    Args:
+        key (dict): Restriction including the primary key of imaging.Activity.
+        trace_keys (list): Primary key from imaging.Activity.Trace of each ROI.
+        nframes (int): Number of frames of the scan.
+        frame_rate (float): (Hz) Frame rate of the scan.
+
+    Returns:
+        frame_times (np.ndarray): (s) (fields x frames) acquisition time of each frame
+            relative to the start of the scan.
+        roi_fields (np.ndarray): Row of `frame_times` of each ROI.
+    """
+    scan, imaging = _linking_module.scan, _linking_module.imaging
+    ndepths, nfields = (scan.ScanInfo & key).fetch1("ndepths", "nfields")
+    fields = scan.ScanInfo.Field & key
+
+    if "frame_times" in fields.heading.secondary_attributes:
+        field_frame_times = fields.fetch("frame_times", order_by="field_idx")
+    else:
+        field_frame_times = [None] * len(fields)
+    delay_images = fields.fetch("delay_image", order_by="field_idx")
+
+    frame_times = np.vstack(
+        [
+            np.asarray(field_times, dtype=float)
+            if field_times is not None
+            else np.arange(nframes) / frame_rate
+            + (np.nanmean(delay_image) / 1000 if delay_image is not None else 0.0)
+            for field_times, delay_image in zip(field_frame_times, delay_images)
+        ]
+    )
+
+    roi_fields = np.zeros(len(trace_keys), dtype=int)
+    if nfields > 1 and nfields == ndepths:
+        mask_planes = dict(
+            zip(*(imaging.Segmentation.Mask & key).fetch("mask", "mask_center_z"))
+        )
+        roi_fields = np.array(
+            [
+                np.clip(np.nan_to_num(mask_planes[trace_key["mask"]]), 0, nfields - 1)
+                for trace_key in trace_keys
+            ]
+        ).astype(int)
+
+    return frame_times, roi_fields
+
+
+def _iter_aligned_trial_activities(key, trial_keys, trace_keys, align, batch_size):
+    """Yield AlignedTrialActivity entries in batches of at most `batch_size` rows.
+
+    Trials are aligned a few at a time so that only one batch of aligned traces is
+    held in memory.
+
+    Args:
+        key (dict): Primary key from ActivityAlignment.
+        trial_keys (list): Primary key from trial.Trial of each trial.
+        trace_keys (list): Primary key from imaging.Activity.Trace of each ROI.
+        align (callable): align(trials, rois) returns the (trials x ROIs x samples)
+            aligned activity of the given slices of trials and ROIs.
+        batch_size (int): Maximum number of entries per batch.
+
+    Yields:
+        aligned_trial_activities (list): Entries of AlignedTrialActivity.
+    """
+    trials_per_batch = max(1, batch_size // max(len(trace_keys), 1))
+    for batch_start in range(0, len(trial_keys), trials_per_batch):
+        batch = slice(batch_start, batch_start + trials_per_batch)
+        aligned_activities = align(batch, slice(None))
+        aligned_trial_activities = [
+            {**key, **trial_key, **trace_key, "aligned_trace": aligned_trace}
+            for trial_key, roi_aligned_activities in zip(
+                trial_keys[batch], aligned_activities
+            )
+            for trace_key, aligned_trace in zip(trace_keys, roi_aligned_activities)
+        ]
+        for row_start in range(0, len(aligned_trial_activities), batch_size):
+            yield aligned_trial_activities[row_start : row_start + batch_size]
+
+
+def _iter_aligned_roi_activities(key, trial_keys, trace_keys, align, batch_size):
+    """Yield AlignedROIActivity entries, holding about `batch_size` aligned traces.
+
+    Args:
+        key (dict): Primary key from ActivityAlignment.
+        trial_keys (list): Primary key from trial.Trial of each trial.
+        trace_keys (list): Primary key from imaging.Activity.Trace of each ROI.
+        align (callable): align(trials, rois) returns the (trials x ROIs x samples)
+            aligned activity of the given slices of trials and ROIs.
+        batch_size (int): Approximate number of aligned traces per batch.
+
+    Yields:
+        aligned_roi_activities (list): Entries of AlignedROIActivity.
+    """
+    trial_ids = np.array([trial_key["trial_id"] for trial_key in trial_keys])
+    rois_per_batch = max(1, batch_size // max(len(trial_keys), 1))
+    for batch_start in range(0, len(trace_keys), rois_per_batch):
+        batch = slice(batch_start, batch_start + rois_per_batch)
+        # (ROIs x trials x samples)
+        aligned_activities = np.ascontiguousarray(
+            align(slice(None), batch).transpose(1, 0, 2), dtype=np.float32
+        )
+        yield [
+            {
+                **key,
+                **trace_key,
+                "trial_ids": trial_ids,
+                "aligned_traces": aligned_traces,
+            }
+            for trace_key, aligned_traces in zip(trace_keys[batch], aligned_activities)
+        ]
+
+
+def _get_trial_averaged_traces(key, trials):
+    """Return TrialAveragedActivity.Trace entries from the activity of each trial.
+
+    Args:
+        key (dict): Primary key from TrialAveragedActivity.
+        trials (iterator): (trace_keys, trial_activities) of one trial at a time, as
+            yielded by `ActivityAlignment.iter_trial_activities`, with the ROIs in the
+            same order in every trial.
+
+    Returns:
+        trial_averaged_traces (list): Entries of TrialAveragedActivity.Trace, none
+            without trials.
+    """
+    trace_keys, first_trial_activities = next(trials, ([], None))
+    if first_trial_activities is None:
+        return []
+    trial_mean, trial_sem, trial_count = nan_welford(
+        itertools.chain(
+            [first_trial_activities],
+            (trial_activities for _, trial_activities in trials),
+        )
+    )
+    return [
+        {
+            **key,
+            **trace_key,
+            "trial_mean": mean,
+            "trial_sem": sem,
+            "trial_count": count,
+        }
+        for trace_key, mean, sem, count in zip(
+            trace_keys, trial_mean, trial_sem, trial_count
+        )
+    ]
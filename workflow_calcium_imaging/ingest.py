@@ -1,22 +1,24 @@
+import argparse
 import csv
+import os
 import pathlib
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-
-from element_interface.utils import (
-    find_full_path,
-    find_root_directory,
-    ingest_csv_to_table,
-)
-
-from workflow_calcium_imaging.paths import get_imaging_root_data_dir
-from workflow_calcium_imaging.pipeline import (
-    Equipment,
-    event,
-    scan,
-    session,
-    subject,
-    trial,
+from types import SimpleNamespace
+
+import datajoint as dj
+import pandas as pd
+from element_interface.utils import ingest_csv_to_table
+
+from workflow_calcium_imaging import pipeline
+from workflow_calcium_imaging.paths import (
+    find_full_path_cached,
+    find_root_directory_cached,
+    flush_root_index,
+    get_imaging_root_data_dir,
 )
 
 
@@ -33,55 +35,195 @@ def ingest_subjects(
         verbose (bool): Display number of entries inserted when ingesting.
     """
     csvs = [subject_csv_path]
-    tables = [subject.Subject()]
+    tables = [pipeline.subject.Subject()]
 
     ingest_csv_to_table(csvs, tables, skip_duplicates=skip_duplicates, verbose=verbose)
 
 
-def ingest_sessions(
-    session_csv_path="./user_data/sessions.csv", skip_duplicates=True, verbose=True
+def discover_sessions(
+    session_csv_path="./user_data/sessions.csv",
+    num_workers=8,
+    verbose=True,
+    manifest_path=None,
 ):
-    """Ingests all the manual table starting from session schema from
-    ./user_data/sessions.csv.
+    """Identify the scan files, acquisition time and scanner of each session in
+    ./user_data/sessions.csv, without accessing the database.
+
+    Sessions are read concurrently by a pool of threads. For ScanImage, only the
+    header of the first tiff file is read. With a manifest, sessions whose directory
+    is unchanged since the previous run are not read again.
 
     Args:
         session_csv_path (str): relative path of session csv.
-        skip_duplicates (bool): Default True. Passed to DataJoint insert.
-        verbose (bool): Default True. Display number of entries inserted when ingesting.
+        num_workers (int): Default 8. Number of threads reading session directories.
+        verbose (bool): Default True. Display the time taken by each session and by
+            the file discovery and metadata phases.
+        manifest_path (str): Optional. Path of the SQLite manifest of previously read
+            sessions. Defaults to `dj.config["custom"]["ingest_manifest_path"]`; no
+            manifest is used if neither is set.
+
+    Returns:
+        sessions (list): One dictionary per readable session, in csv order, with keys
+            subject, session_dir, root_data_dir, acq_software, recording_time, scanner.
     """
     root_data_dirs = get_imaging_root_data_dir()
 
-    # ---------- Insert new "Session" and "Scan" ---------
     with open(session_csv_path, newline="") as f:
         input_sessions = list(csv.DictReader(f, delimiter=","))
 
-    # Folder structure: root / subject / session / .tif (raw)
-    session_list, session_dir_list, scan_list, scanner_list = [], [], [], []
+    manifest_path = manifest_path or dj.config["custom"].get("ingest_manifest_path")
+    manifest = SessionManifest(manifest_path) if manifest_path else None
+    manifest_entries = manifest.fetch() if manifest else {}
 
-    for sess in input_sessions:
-        sess_dir = find_full_path(root_data_dirs, Path(sess["session_dir"]))
-        root_data_dir = find_root_directory(root_data_dirs, sess_dir)
-
-        # search for either ScanImage or Scanbox files (in that order)
-        for scan_pattern, scan_type, glob_func in zip(
-            ["*.tif", "*.sbx"],
-            ["ScanImage", "Scanbox"],
-            [sess_dir.glob, sess_dir.rglob],
-        ):
-            scan_filepaths = [fp.as_posix() for fp in glob_func(scan_pattern)]
-            if len(scan_filepaths):
-                acq_software = scan_type
-                break
-        else:
-            raise FileNotFoundError(
-                "Unable to identify scan files from the supported "
-                + "acquisition softwares (ScanImage, Scanbox) at: "
-                + f"{sess_dir}"
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        located_sessions = list(
+            executor.map(
+                lambda sess: _locate_session(sess, root_data_dirs, manifest_entries),
+                input_sessions,
             )
+        )
+        flush_root_index()
+        discovery_time, start_time = time.time() - start_time, time.time()
+        discovered_sessions = list(
+            executor.map(_read_session_metadata, located_sessions)
+        )
+        metadata_time = time.time() - start_time
+
+    sessions, updated_sessions = [], []
+    for sess, located_session, (session_info, elapsed) in zip(
+        input_sessions, located_sessions, discovered_sessions
+    ):
+        is_unchanged = located_session["is_unchanged"]
+        if verbose:
+            print(
+                f"{'Unchanged' if is_unchanged else 'Read'} {sess['session_dir']}"
+                + f" in {located_session['elapsed'] + elapsed:.2f}s"
+            )
+        if session_info is not None:
+            sessions.append(session_info)
+            if not is_unchanged:
+                updated_sessions.append(session_info)
+
+    if manifest:
+        manifest.update(updated_sessions)
+        manifest.close()
+
+    if verbose:
+        print(
+            f"\n---- Discovered {len(sessions)}/{len(input_sessions)} session(s):"
+            + f" file discovery {discovery_time:.2f}s,"
+            + f" metadata {metadata_time:.2f}s ----"
+        )
+    return sessions
+
+
+def _locate_session(sess, root_data_dirs, manifest_entries):
+    """Find the directory and scan files of a session.
+
+    Args:
+        sess (dict): Row of sessions.csv.
+        root_data_dirs (list): Imaging root data directories.
+        manifest_entries (dict): Session information of the manifest, per session
+            directory.
+
+    Returns:
+        located_session (dict): Session information from the manifest if the session
+            directory is unchanged (`is_unchanged`), otherwise its scan files and
+            acquisition software; and the time taken (`elapsed`).
+    """
+    start_time = time.time()
+
+    # Folder structure: root / subject / session / .tif (raw)
+    sess_dir = find_full_path_cached(root_data_dirs, Path(sess["session_dir"]))
+    root_data_dir = find_root_directory_cached(root_data_dirs, sess_dir)
+
+    dir_signature = _get_dir_signature(sess_dir)
+    manifest_entry = manifest_entries.get(sess_dir.as_posix())
+    if (
+        manifest_entry is not None
+        and manifest_entry["dir_signature"] == dir_signature
+        and manifest_entry["subject"] == sess["subject"]
+    ):
+        return dict(
+            manifest_entry,
+            session_dir=sess_dir,
+            root_data_dir=root_data_dir,
+            is_unchanged=True,
+            elapsed=time.time() - start_time,
+        )
+
+    # search for either ScanImage or Scanbox files (in that order)
+    for scan_pattern, scan_type, glob_func in zip(
+        ["*.tif", "*.sbx"],
+        ["ScanImage", "Scanbox"],
+        [sess_dir.glob, sess_dir.rglob],
+    ):
+        scan_filepaths = [fp.as_posix() for fp in glob_func(scan_pattern)]
+        if len(scan_filepaths):
+            acq_software = scan_type
+            break
+    else:
+        raise FileNotFoundError(
+            "Unable to identify scan files from the supported "
+            + "acquisition softwares (ScanImage, Scanbox) at: "
+            + f"{sess_dir}"
+        )
+
+    return dict(
+        subject=sess["subject"],
+        session_dir=sess_dir,
+        root_data_dir=root_data_dir,
+        dir_signature=dir_signature,
+        scan_filepaths=scan_filepaths,
+        acq_software=acq_software,
+        is_unchanged=False,
+        elapsed=time.time() - start_time,
+    )
+
+
+def _read_session_metadata(located_session):
+    """Read the acquisition time and scanner of a session from its scan files.
+
+    Args:
+        located_session (dict): Session returned by `_locate_session`.
 
-        if acq_software == "ScanImage":
+    Returns:
+        session_info (dict): Session information, or None if the scan files could not
+            be read.
+        elapsed (float): (s) Time taken to read the scan files.
+    """
+    start_time = time.time()
+    session_info = {
+        k: located_session[k]
+        for k in (
+            "subject",
+            "session_dir",
+            "root_data_dir",
+            "dir_signature",
+            "acq_software",
+        )
+    }
+    if located_session["is_unchanged"]:
+        session_info.update(
+            recording_time=located_session["recording_time"],
+            scanner=located_session["scanner"],
+        )
+        return session_info, time.time() - start_time
+
+    acq_software = located_session["acq_software"]
+    scan_filepaths = located_session["scan_filepaths"]
+
+    if acq_software == "ScanImage":
+        from element_interface import scanimage_utils
+
+        try:  # attempt to read the header of the first .tif as a scanimage file
+            loaded_scan = _read_scanimage_header(scan_filepaths[0])
+            recording_time = scanimage_utils.get_scanimage_acq_time(loaded_scan)
+            header = scanimage_utils.parse_scanimage_header(loaded_scan)
+            scanner = header["SI_imagingSystem"].strip("'")
+        except Exception:
             import scanreader
-            from element_interface import scanimage_utils
 
             try:  # attempt to read .tif as a scanimage file
                 loaded_scan = scanreader.read_scan(scan_filepaths)
@@ -90,62 +232,250 @@ def ingest_sessions(
                 scanner = header["SI_imagingSystem"].strip("'")
             except Exception as e:
                 print(f"ScanImage loading error: {scan_filepaths}\n{str(e)}")
-                continue
-        elif acq_software == "Scanbox":
-            import sbxreader
-
-            try:  # attempt to load Scanbox
-                sbx_fp = pathlib.Path(scan_filepaths[0])
-                sbx_meta = sbxreader.sbx_get_metadata(sbx_fp)
-                # read from file when Scanbox support this
-                recording_time = datetime.fromtimestamp(sbx_fp.stat().st_ctime)
-                scanner = sbx_meta.get("imaging_system", "Scanbox")
-            except Exception as e:
-                print(f"Scanbox loading error: {scan_filepaths}\n{str(e)}")
-                continue
-        else:
-            raise NotImplementedError(
-                "Processing scan from acquisition software of "
-                + f"type {acq_software} is not yet implemented"
+                return None, time.time() - start_time
+    elif acq_software == "Scanbox":
+        import sbxreader
+
+        try:  # attempt to load Scanbox
+            sbx_fp = pathlib.Path(scan_filepaths[0])
+            sbx_meta = sbxreader.sbx_get_metadata(sbx_fp)
+            # read from file when Scanbox support this
+            recording_time = datetime.fromtimestamp(sbx_fp.stat().st_ctime)
+            scanner = sbx_meta.get("imaging_system", "Scanbox")
+        except Exception as e:
+            print(f"Scanbox loading error: {scan_filepaths}\n{str(e)}")
+            return None, time.time() - start_time
+    else:
+        raise NotImplementedError(
+            "Processing scan from acquisition software of "
+            + f"type {acq_software} is not yet implemented"
+        )
+
+    session_info.update(recording_time=recording_time, scanner=scanner)
+    return session_info, time.time() - start_time
+
+
+def _get_dir_signature(sess_dir):
+    """Modification time, total size and number of files of a session directory.
+
+    Only the entries of the directory itself are listed; the modification time of a
+    sub-directory reflects files added to or removed from it.
+
+    Args:
+        sess_dir (pathlib.Path): Session directory.
+
+    Returns:
+        dir_signature (tuple): (mtime_ns, size, file_count) of the directory.
+    """
+    mtime_ns, size, file_count = sess_dir.stat().st_mtime_ns, 0, 0
+    with os.scandir(sess_dir) as entries:
+        for entry in entries:
+            stat = entry.stat()
+            if entry.is_dir():
+                mtime_ns = max(mtime_ns, stat.st_mtime_ns)
+            else:
+                size += stat.st_size
+                file_count += 1
+    return mtime_ns, size, file_count
+
+
+class SessionManifest:
+    """SQLite manifest of the sessions read by `discover_sessions`.
+
+    Stores, per session directory, its signature (modification time, size and file
+    count) and the parsed session information.
+
+    Args:
+        manifest_path (str): Path of the SQLite database file.
+    """
+
+    def __init__(self, manifest_path):
+        self.connection = sqlite3.connect(manifest_path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS session (
+                session_dir TEXT PRIMARY KEY,
+                mtime_ns INTEGER,
+                size INTEGER,
+                file_count INTEGER,
+                subject TEXT,
+                acq_software TEXT,
+                recording_time TEXT,
+                scanner TEXT
             )
+            """
+        )
+
+    def fetch(self):
+        """Return the session information of each session directory."""
+        return {
+            session_dir: dict(
+                subject=subject,
+                acq_software=acq_software,
+                recording_time=datetime.fromisoformat(recording_time),
+                scanner=scanner,
+                dir_signature=(mtime_ns, size, file_count),
+            )
+            for (
+                session_dir,
+                mtime_ns,
+                size,
+                file_count,
+                subject,
+                acq_software,
+                recording_time,
+                scanner,
+            ) in self.connection.execute("SELECT * FROM session")
+        }
+
+    def update(self, sessions):
+        """Insert or replace the entries of sessions returned by `discover_sessions`."""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO session VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        sess["session_dir"].as_posix(),
+                        *sess["dir_signature"],
+                        sess["subject"],
+                        sess["acq_software"],
+                        sess["recording_time"].isoformat(),
+                        sess["scanner"],
+                    )
+                    for sess in sessions
+                ],
+            )
+
+    def close(self):
+        self.connection.close()
 
-        session_key = {"subject": sess["subject"], "session_datetime": recording_time}
-        if session_key not in session.Session():
-            scanner_list.append({"scanner": scanner})
+
+def _read_scanimage_header(scan_filepath):
+    """Read the ScanImage header from the first IFD of a tiff file.
+
+    Args:
+        scan_filepath (str): Path of a ScanImage tiff file.
+
+    Returns:
+        scan (types.SimpleNamespace): Object with the `header` attribute of a scan
+            loaded with scanreader, accepted by `element_interface.scanimage_utils`.
+    """
+    import tifffile
+
+    with tifffile.TiffFile(scan_filepath) as tiff_file:
+        page = tiff_file.pages[0]
+        header = "\n".join(
+            tag.value
+            for tag in (page.tags.get("ImageDescription"), page.tags.get("Software"))
+            if tag is not None
+        )
+    return SimpleNamespace(header=header)
+
+
+def ingest_sessions(
+    session_csv_path="./user_data/sessions.csv",
+    skip_duplicates=True,
+    verbose=True,
+    num_workers=8,
+    manifest_path=None,
+):
+    """Ingests all the manual table starting from session schema from
+    ./user_data/sessions.csv.
+
+    Args:
+        session_csv_path (str): relative path of session csv.
+        skip_duplicates (bool): Default True. Passed to DataJoint insert.
+        verbose (bool): Default True. Display number of entries inserted when ingesting.
+        num_workers (int): Default 8. Number of threads reading session directories.
+        manifest_path (str): Optional. Path of the SQLite manifest of previously read
+            sessions, see `discover_sessions`.
+    """
+    # ---------- Insert new "Session" and "Scan" ---------
+    sessions = discover_sessions(
+        session_csv_path,
+        num_workers=num_workers,
+        verbose=verbose,
+        manifest_path=manifest_path,
+    )
+    insert_sessions(sessions, skip_duplicates=skip_duplicates, verbose=verbose)
+
+
+def insert_sessions(sessions, skip_duplicates=True, verbose=True):
+    """Insert the sessions found by `discover_sessions` that are not yet ingested.
+
+    Args:
+        sessions (list): Sessions returned by `discover_sessions`.
+        skip_duplicates (bool): Default True. Passed to DataJoint insert.
+        verbose (bool): Default True. Display number of entries inserted when ingesting.
+    """
+    start_time = time.time()
+    session_keys = [
+        {"subject": sess["subject"], "session_datetime": sess["recording_time"]}
+        for sess in sessions
+    ]
+    # resolve already ingested sessions with a single query
+    existing_sessions = (
+        {
+            (key["subject"], key["session_datetime"])
+            for key in (pipeline.session.Session & session_keys).fetch("KEY")
+        }
+        if session_keys
+        else set()
+    )
+
+    session_list, session_dir_list, scan_list, scanner_list = [], [], [], []
+
+    for sess, session_key in zip(sessions, session_keys):
+        if (
+            session_key["subject"],
+            session_key["session_datetime"],
+        ) not in existing_sessions:
+            scanner_list.append({"scanner": sess["scanner"]})
             session_list.append(session_key)
             scan_list.append(
                 {
                     **session_key,
                     "scan_id": 0,
-                    "scanner": scanner,
-                    "acq_software": acq_software,
+                    "scanner": sess["scanner"],
+                    "acq_software": sess["acq_software"],
                 }
             )
 
             session_dir_list.append(
                 {
                     **session_key,
-                    "session_dir": sess_dir.relative_to(root_data_dir).as_posix(),
+                    "session_dir": sess["session_dir"]
+                    .relative_to(sess["root_data_dir"])
+                    .as_posix(),
                 }
             )
+    db_check_time, start_time = time.time() - start_time, time.time()
+
     new_equipment = set(val for dic in scanner_list for val in dic.values())
     if verbose:
         print(
             f"\n---- Insert {len(new_equipment)} entry(s) into "
             + "experiment.Equipment ----"
         )
-    Equipment.insert(scanner_list, skip_duplicates=skip_duplicates)
+    pipeline.Equipment.insert(scanner_list, skip_duplicates=skip_duplicates)
 
     if verbose:
         print(f"\n---- Insert {len(session_list)} entry(s) into session.Session ----")
-    session.Session.insert(session_list, skip_duplicates=skip_duplicates)
-    session.SessionDirectory.insert(session_dir_list, skip_duplicates=skip_duplicates)
+    pipeline.session.Session.insert(session_list, skip_duplicates=skip_duplicates)
+    pipeline.session.SessionDirectory.insert(
+        session_dir_list, skip_duplicates=skip_duplicates
+    )
 
     if verbose:
         print(f"\n---- Insert {len(scan_list)} entry(s) into scan.Scan ----")
-    scan.Scan.insert(scan_list, skip_duplicates=skip_duplicates)
+    pipeline.scan.Scan.insert(scan_list, skip_duplicates=skip_duplicates)
+    insert_time = time.time() - start_time
 
     if verbose:
+        print(
+            f"\n---- Database check {db_check_time:.2f}s,"
+            + f" insert {insert_time:.2f}s ----"
+        )
         print("\n---- Successfully completed ingest_sessions ----")
 
 
@@ -175,43 +505,129 @@ def ingest_events(
         verbose (bool, optional): Display number of entries inserted when ingesting.
             Default True.
     """
-    csvs = [
-        recording_csv_path,
-        recording_csv_path,
-        block_csv_path,
-        block_csv_path,
-        trial_csv_path,
-        trial_csv_path,
-        trial_csv_path,
-        trial_csv_path,
-        event_csv_path,
-        event_csv_path,
-        event_csv_path,
-    ]
-    tables = [
-        event.BehaviorRecording(),
-        event.BehaviorRecording.File(),
-        trial.Block(),
-        trial.Block.Attribute(),
-        trial.TrialType(),
-        trial.Trial(),
-        trial.Trial.Attribute(),
-        trial.BlockTrial(),
-        event.EventType(),
-        event.Event(),
-        trial.TrialEvent(),
+    csv_tables = [
+        (
+            recording_csv_path,
+            [
+                pipeline.event.BehaviorRecording(),
+                pipeline.event.BehaviorRecording.File(),
+            ],
+        ),
+        (block_csv_path, [pipeline.trial.Block(), pipeline.trial.Block.Attribute()]),
+        (
+            trial_csv_path,
+            [
+                pipeline.trial.TrialType(),
+                pipeline.trial.Trial(),
+                pipeline.trial.Trial.Attribute(),
+                pipeline.trial.BlockTrial(),
+            ],
+        ),
+        (
+            event_csv_path,
+            [
+                pipeline.event.EventType(),
+                pipeline.event.Event(),
+                pipeline.trial.TrialEvent(),
+            ],
+        ),
     ]
+    chunksize = dj.config["custom"].get("ingest_csv_chunk_size", 100000)
+
+    for csv_path, tables in csv_tables:
+        # Allow direct insert required bc element-trial has Imported that should be
+        # Manual
+        insert_csv_chunks(
+            csv_path,
+            tables,
+            chunksize=chunksize,
+            skip_duplicates=skip_duplicates,
+            verbose=verbose,
+            allow_direct_insert=True,
+        )
 
-    # Allow direct insert required bc element-trial has Imported that should be Manual
-    ingest_csv_to_table(
-        csvs,
-        tables,
-        skip_duplicates=skip_duplicates,
-        verbose=verbose,
-        allow_direct_insert=True,
+
+# dtypes of the known csv columns, others are read as str
+_csv_dtypes = {
+    "block_id": "Int64",
+    "trial_id": "Int64",
+    "block_start_time": "float64",
+    "block_stop_time": "float64",
+    "trial_start_time": "float64",
+    "trial_stop_time": "float64",
+    "event_start_time": "float64",
+    "event_end_time": "float64",
+}
+
+
+def read_csv_chunks(csv_path, chunksize=100000):
+    """Parse a csv in chunks of rows with explicit column dtypes.
+
+    Empty values are kept as empty strings in text columns, as read by `csv`, and are
+    missing values (NaN, or NA in the nullable integer columns) in numeric columns.
+
+    Args:
+        csv_path (str): Path of the csv.
+        chunksize (int): Default 100000. Number of rows per chunk.
+
+    Returns:
+        chunks (iterator): `pandas.DataFrame` of each chunk of rows.
+    """
+    columns = pd.read_csv(csv_path, nrows=0).columns
+    dtypes = {col: _csv_dtypes.get(col, str) for col in columns}
+    return pd.read_csv(
+        csv_path,
+        dtype=dtypes,
+        keep_default_na=False,
+        na_values={col: [""] for col in columns if dtypes[col] != str},
+        chunksize=chunksize,
     )
 
 
+def insert_csv_chunks(
+    csv_path, tables, chunksize=100000, skip_duplicates=True, verbose=True, **kwargs
+):
+    """Insert a csv into several tables, parsing it once and in chunks.
+
+    Each table receives, chunk by chunk, the distinct rows of the csv columns that are
+    among its attributes, so that memory use is bounded by the chunk size. Rows whose
+    primary key was inserted from an earlier chunk, e.g. the lookup rows repeated in
+    every chunk, are not inserted again, so that `skip_duplicates=False` only reports
+    entries already in the table.
+
+    Args:
+        csv_path (str): Path of the csv.
+        tables (list): Tables to insert into, in insertion order.
+        chunksize (int): Default 100000. Number of csv rows per chunk.
+        skip_duplicates (bool): Default True. Passed to DataJoint insert.
+        verbose (bool): Default True. Display number of entries inserted per table.
+        **kwargs: Passed to DataJoint insert, e.g. allow_direct_insert.
+    """
+    start_lengths = [len(table) for table in tables] if verbose else None
+    inserted_key_hashes = [set() for _ in tables]
+    for chunk in read_csv_chunks(csv_path, chunksize=chunksize):
+        for table, key_hashes in zip(tables, inserted_key_hashes):
+            columns = [col for col in table.heading.names if col in chunk.columns]
+            rows = chunk[columns].drop_duplicates()
+            key_columns = [col for col in table.primary_key if col in columns]
+            if not skip_duplicates and key_columns:
+                row_key_hashes = pd.util.hash_pandas_object(
+                    rows[key_columns], index=False
+                ).tolist()
+                rows = rows[[h not in key_hashes for h in row_key_hashes]]
+                key_hashes.update(row_key_hashes)
+            if rows.isna().values.any():  # missing values are inserted as NULL
+                rows = rows.astype(object).where(rows.notna(), None)
+            table.insert(rows, skip_duplicates=skip_duplicates, **kwargs)
+
+    if verbose:
+        for table, start_length in zip(tables, start_lengths):
+            print(
+                f"\n---- Insert {len(table) - start_length} entry(s) into "
+                + f"{table.table_name} from {csv_path} ----"
+            )
+
+
 def ingest_alignment(
     alignment_csv_path="./user_data/alignments.csv", skip_duplicates=True, verbose=True
 ):
@@ -227,13 +643,197 @@ def ingest_alignment(
     """
 
     csvs = [alignment_csv_path]
-    tables = [event.AlignmentEvent()]
+    tables = [pipeline.event.AlignmentEvent()]
 
     ingest_csv_to_table(csvs, tables, skip_duplicates=skip_duplicates, verbose=verbose)
 
 
+# Required columns of each user_data csv
+_user_data_csvs = {
+    "subjects": ("subjects.csv", ("subject", "sex", "subject_birth_date")),
+    "sessions": ("sessions.csv", ("subject", "session_dir")),
+    "recordings": (
+        "behavior_recordings.csv",
+        ("subject", "session_datetime", "filepath"),
+    ),
+    "blocks": (
+        "blocks.csv",
+        (
+            "subject",
+            "session_datetime",
+            "block_id",
+            "block_start_time",
+            "block_stop_time",
+            "attribute_name",
+            "attribute_value",
+        ),
+    ),
+    "trials": (
+        "trials.csv",
+        (
+            "subject",
+            "session_datetime",
+            "block_id",
+            "trial_id",
+            "trial_start_time",
+            "trial_stop_time",
+            "trial_type",
+            "attribute_name",
+            "attribute_value",
+        ),
+    ),
+    "events": (
+        "events.csv",
+        ("subject", "session_datetime", "trial_id", "event_start_time", "event_type"),
+    ),
+    "alignments": (
+        "alignments.csv",
+        (
+            "alignment_name",
+            "alignment_event_type",
+            "alignment_time_shift",
+            "start_event_type",
+            "start_time_shift",
+            "end_event_type",
+            "end_time_shift",
+        ),
+    ),
+}
+
+
+def validate_csvs(data_dir="./user_data"):
+    """Check that all user_data csvs exist and have their required columns.
+
+    Args:
+        data_dir (str): Directory of the user_data csvs.
+
+    Returns:
+        csvs (dict): Path and number of rows of each csv, by name, e.g. "sessions".
+
+    Raises:
+        ValueError: Listing every missing csv and column.
+    """
+    csvs, errors = {}, []
+    for name, (filename, required_columns) in _user_data_csvs.items():
+        csv_path = Path(data_dir) / filename
+        if not csv_path.is_file():
+            errors.append(f"{csv_path}: file not found")
+            continue
+        with open(csv_path, newline="") as f:
+            reader = csv.reader(f, delimiter=",")
+            columns = next(reader, [])
+            nrows = sum(1 for row in reader if row)
+        missing_columns = [col for col in required_columns if col not in columns]
+        if missing_columns:
+            errors.append(f"{csv_path}: missing column(s) {', '.join(missing_columns)}")
+        csvs[name] = (str(csv_path), nrows)
+
+    if errors:
+        raise ValueError("Invalid user_data csv(s):\n" + "\n".join(errors))
+    return csvs
+
+
+def main(argv=None):
+    """Ingest all user_data csvs of a directory.
+
+    Subjects are inserted while session directories are read, then sessions, trials
+    and events, and event alignments are inserted in turn.
+
+    Args:
+        argv (list): Optional. Command-line arguments, defaults to `sys.argv[1:]`.
+    """
+    parser = argparse.ArgumentParser(
+        description="Ingest the subjects, sessions, trials, events and event"
+        + " alignments of a user_data directory."
+    )
+    parser.add_argument(
+        "data_dir",
+        nargs="?",
+        default="./user_data",
+        help="directory of the user_data csvs (default: ./user_data)",
+    )
+    parser.add_argument(
+        "--num-workers",
+        type=int,
+        default=8,
+        help="number of threads reading session directories (default: 8)",
+    )
+    parser.add_argument(
+        "--no-skip-duplicates",
+        dest="skip_duplicates",
+        action="store_false",
+        help="raise an error on entries that are already ingested",
+    )
+    parser.add_argument(
+        "-q", "--quiet", dest="verbose", action="store_false", help="less output"
+    )
+    args = parser.parse_args(argv)
+
+    try:
+        csvs = validate_csvs(args.data_dir)
+    except ValueError as e:
+        parser.error(str(e))
+    csv_paths = {name: csv_path for name, (csv_path, _) in csvs.items()}
+    options = dict(skip_duplicates=args.skip_duplicates, verbose=args.verbose)
+
+    stages = []
+
+    def run_stage(stage, csv_names, func, *func_args, **func_kwargs):
+        start_time = time.time()
+        result = func(*func_args, **func_kwargs)
+        nrows = sum(csvs[name][1] for name in csv_names)
+        stages.append((stage, nrows, time.time() - start_time))
+        return result
+
+    # subjects are inserted while session directories are read, which needs no
+    # database access
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        subjects_future = executor.submit(
+            run_stage,
+            "subjects",
+            ["subjects"],
+            ingest_subjects,
+            csv_paths["subjects"],
+            **options,
+        )
+        sessions = run_stage(
+            "session discovery",
+            ["sessions"],
+            discover_sessions,
+            csv_paths["sessions"],
+            num_workers=args.num_workers,
+            verbose=args.verbose,
+        )
+        subjects_future.result()
+
+    run_stage("session insert", ["sessions"], insert_sessions, sessions, **options)
+    run_stage(
+        "trials and events",
+        ["recordings", "blocks", "trials", "events"],
+        ingest_events,
+        recording_csv_path=csv_paths["recordings"],
+        block_csv_path=csv_paths["blocks"],
+        trial_csv_path=csv_paths["trials"],
+        event_csv_path=csv_paths["events"],
+        **options,
+    )
+    # event alignments refer to the event types inserted with the events
+    run_stage(
+        "event alignments",
+        ["alignments"],
+        ingest_alignment,
+        alignment_csv_path=csv_paths["alignments"],
+        **options,
+    )
+
+    if args.verbose:
+        print("\n---- Ingest stages ----")
+        for stage, nrows, stage_time in stages:
+            print(
+                f"{stage}: {nrows} csv row(s) in {stage_time:.2f}s"
+                + f" ({nrows / max(stage_time, 1e-9):.1f} rows/s)"
+            )
+
+
 if __name__ == "__main__":
-    ingest_subjects()
-    ingest_sessions()
-    ingest_events()
-    ingest_alignment()
+    main()
@@ -0,0 +1,363 @@
+"""Sparse (masks x pixels) representation of the masks of `imaging.Segmentation`."""
+
+import datajoint as dj
+import numpy as np
+from scipy import sparse
+
+from .utils import LRUCache
+
+_linking_module = None
+
+_mask_matrix_cache = LRUCache(max_bytes=0)
+
+
+def set_linking_module(linking_module):
+    """Set the module from which the tables of the masks are resolved.
+
+    Args:
+        linking_module (module): A module containing the activated `imaging` and
+            `scan` schemas, e.g. the linking module of the `analysis` schema.
+    """
+    global _linking_module
+    _linking_module = linking_module
+
+
+def get_mask_matrix(key):
+    """Fetch the masks of an imaging.Segmentation entry as a sparse matrix.
+
+    All masks are fetched in one query. Row `i` of the matrix holds the weights of mask
+    `mask_ids[i]` at each pixel of the (depth x height x width) imaging volume,
+    flattened in C order. Matrices are cached per imaging.Segmentation key, in at most
+    `dj.config["custom"]["mask_matrix_cache_size"]` megabytes (default 256; 0
+    disables caching).
+
+    Args:
+        key (dict): Restriction including the primary key of imaging.Segmentation.
+
+    Returns:
+        mask_ids (np.ndarray): Mask ID of each row, in increasing order.
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) mask weights.
+        image_shape (tuple): (depth, height, width) of the imaging volume.
+    """
+    segmentation = _linking_module.imaging.Segmentation
+    cache_key = tuple((attr, key[attr]) for attr in segmentation.primary_key)
+    _mask_matrix_cache.max_bytes = (
+        dj.config["custom"].get("mask_matrix_cache_size", 256) * 1024**2
+    )
+
+    cached = _mask_matrix_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    mask_ids, mask_xpix, mask_ypix, mask_zpix, mask_weights = (
+        segmentation.Mask & dict(cache_key)
+    ).fetch(
+        "mask",
+        "mask_xpix",
+        "mask_ypix",
+        "mask_zpix",
+        "mask_weights",
+        order_by="mask",
+    )
+    mask_zpix = [
+        np.zeros(len(xpix), dtype=int) if zpix is None else zpix
+        for xpix, zpix in zip(mask_xpix, mask_zpix)
+    ]
+    heights, widths = (_linking_module.scan.ScanInfo.Field & dict(cache_key)).fetch(
+        "px_height", "px_width"
+    )
+    depth = max((int(np.max(zpix)) + 1 for zpix in mask_zpix if len(zpix)), default=1)
+    image_shape = (depth, int(max(heights)), int(max(widths)))
+
+    mask_matrix = build_mask_matrix(
+        mask_xpix, mask_ypix, mask_zpix, mask_weights, image_shape
+    )
+    mask_ids = np.asarray(mask_ids)
+    _mask_matrix_cache.put(cache_key, (mask_ids, mask_matrix, image_shape))
+    return mask_ids, mask_matrix, image_shape
+
+
+def build_mask_matrix(mask_xpix, mask_ypix, mask_zpix, mask_weights, image_shape):
+    """Assemble the pixel coordinates and weights of masks into a sparse matrix.
+
+    Args:
+        mask_xpix (list): X coordinates of the pixels of each mask.
+        mask_ypix (list): Y coordinates of the pixels of each mask.
+        mask_zpix (list): Z coordinates of the pixels of each mask.
+        mask_weights (list): Weights of the pixels of each mask.
+        image_shape (tuple): (depth, height, width) of the imaging volume.
+
+    Returns:
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) mask weights.
+    """
+    npix = [len(xpix) for xpix in mask_xpix]
+    rows = np.repeat(np.arange(len(npix)), npix)
+    if not len(rows):
+        return sparse.csr_matrix((len(npix), int(np.prod(image_shape))))
+    columns = np.ravel_multi_index(
+        (
+            np.concatenate(mask_zpix).astype(int),
+            np.concatenate(mask_ypix).astype(int),
+            np.concatenate(mask_xpix).astype(int),
+        ),
+        image_shape,
+    )
+    return sparse.csr_matrix(
+        (np.concatenate(mask_weights).astype(np.float32), (rows, columns)),
+        shape=(len(npix), int(np.prod(image_shape))),
+    )
+
+
+def get_mask_image(key, masks=None, plane=0, labels=False):
+    """Rasterize masks of an imaging.Segmentation entry into an image of a plane.
+
+    Args:
+        key (dict): Restriction including the primary key of imaging.Segmentation.
+        masks (list): Optional. Mask IDs to rasterize. Defaults to all masks.
+        plane (int): Default 0. Plane of the imaging volume.
+        labels (bool): Default False. Return the mask ID of each pixel (the highest one
+            where masks overlap, -1 outside of masks) instead of a boolean image.
+
+    Returns:
+        mask_image (np.ndarray): (height x width) boolean or mask ID image.
+
+    Raises:
+        ValueError: If a mask ID of `masks` is not in the segmentation.
+    """
+    mask_ids, mask_matrix, image_shape = get_mask_matrix(key)
+    if masks is not None:
+        masks = np.asarray(masks)
+        rows = np.minimum(np.searchsorted(mask_ids, masks), max(len(mask_ids) - 1, 0))
+        missing = masks[mask_ids[rows] != masks] if len(mask_ids) else masks
+        if len(missing):
+            raise ValueError(f"Mask(s) {missing.tolist()} not in the segmentation")
+        mask_ids, mask_matrix = mask_ids[rows], mask_matrix[rows]
+    return rasterize_masks(mask_ids, mask_matrix, image_shape, plane, labels)
+
+
+def rasterize_masks(mask_ids, mask_matrix, image_shape, plane=0, labels=False):
+    """Rasterize the rows of a mask matrix into an image of a plane.
+
+    Args:
+        mask_ids (np.ndarray): Mask ID of each row of `mask_matrix`.
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) mask weights.
+        image_shape (tuple): (depth, height, width) of the imaging volume.
+        plane (int): Default 0. Plane of the imaging volume.
+        labels (bool): Default False. Return the mask ID of each pixel (the highest one
+            where masks overlap, -1 outside of masks) instead of a boolean image.
+
+    Returns:
+        mask_image (np.ndarray): (height x width) boolean or mask ID image.
+    """
+    _, height, width = image_shape
+    plane_pixels = mask_matrix[:, plane * height * width : (plane + 1) * height * width]
+    plane_pixels = (plane_pixels != 0).tocsc()
+    in_mask = np.diff(plane_pixels.indptr) > 0
+    if not labels:
+        return in_mask.reshape(height, width)
+
+    # highest mask ID at each pixel, offset by 1 so that 0 marks empty pixels
+    mask_labels = plane_pixels.multiply(mask_ids[:, None] + 1).tocsc().max(axis=0)
+    return np.asarray(mask_labels.todense()).reshape(height, width) - 1
+
+
+def compute_mask_iou(mask_matrix, other_mask_matrix=None):
+    """Intersection over union of the pixels of pairs of masks.
+
+    Args:
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) masks.
+        other_mask_matrix (scipy.sparse.csr_matrix): Optional. (masks x pixels) masks
+            compared with those of `mask_matrix`. Defaults to `mask_matrix`.
+
+    Returns:
+        iou (scipy.sparse.csr_matrix): (masks x other masks) intersection over union,
+            stored only for overlapping pairs.
+    """
+    masks = (mask_matrix != 0).astype(np.float32)
+    other_masks = (
+        masks
+        if other_mask_matrix is None
+        else (other_mask_matrix != 0).astype(np.float32)
+    )
+    intersection = (masks @ other_masks.T).tocoo()
+    npix = np.asarray(masks.sum(axis=1)).ravel()
+    other_npix = np.asarray(other_masks.sum(axis=1)).ravel()
+    union = npix[intersection.row] + other_npix[intersection.col] - intersection.data
+    return sparse.csr_matrix(
+        (intersection.data / union, (intersection.row, intersection.col)),
+        shape=intersection.shape,
+    )
+
+
+def extract_traces(mask_matrix, frames, normalize=True):
+    """Weighted sum of the pixels of each mask in each frame.
+
+    Args:
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) mask weights.
+        frames (np.ndarray): (frames x depth x height x width), or (frames x pixels),
+            movie of the imaging volume.
+        normalize (bool): Default True. Divide by the sum of the weights of each mask,
+            giving the weighted mean of its pixels.
+
+    Returns:
+        traces (np.ndarray): (masks x frames) traces.
+    """
+    frames = np.asarray(frames).reshape(len(frames), -1)
+    traces = np.asarray(mask_matrix @ frames.T)
+    if normalize:
+        weights = np.asarray(mask_matrix.sum(axis=1))
+        traces = traces / np.where(weights != 0, weights, np.nan)
+    return traces
+
+
+def project_masks(mask_matrix, image_shape):
+    """Project masks on the imaging plane, merging their pixels across depths.
+
+    Args:
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) masks of a
+            (depth x height x width) volume.
+        image_shape (tuple): (depth, height, width) of the imaging volume.
+
+    Returns:
+        projected_masks (scipy.sparse.csr_matrix): (masks x (height * width)) boolean
+            masks.
+    """
+    _, height, width = image_shape
+    projected_masks = sparse.csr_matrix(
+        (
+            np.ones(mask_matrix.nnz, dtype=bool),
+            mask_matrix.indices % (height * width),
+            mask_matrix.indptr,
+        ),
+        shape=(mask_matrix.shape[0], height * width),
+    )
+    projected_masks.sum_duplicates()
+    return projected_masks
+
+
+def compute_mask_roundness(mask_matrix, image_shape):
+    """Roundness of masks, from the weighted covariance of their pixel coordinates.
+
+    Same measure as `imaging.ProcessingQualityMetrics.Mask`: the mean of the two
+    eigenvalues of the covariance of the x and y coordinates, weighted by the pixel
+    weights, divided by the largest eigenvalue. All masks are computed at once from
+    the weighted moments of the sparse mask matrix.
+
+    Args:
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) mask weights.
+        image_shape (tuple): (depth, height, width) of the imaging volume.
+
+    Returns:
+        roundness (np.ndarray): Roundness between 0.5 and 1 of each mask, NaN for masks
+            of a single pixel.
+    """
+    _, height, width = image_shape
+    mask_matrix = mask_matrix.astype(np.float64)  # moments cancel in float32
+    pixels = np.arange(mask_matrix.shape[1])
+    xpix = (pixels % width).astype(float)
+    ypix = (pixels // width % height).astype(float)
+
+    weights = np.asarray(mask_matrix.sum(axis=1)).ravel()
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_x, mean_y, mean_xx, mean_yy, mean_xy = (
+            (mask_matrix @ coordinates) / weights
+            for coordinates in (xpix, ypix, xpix**2, ypix**2, xpix * ypix)
+        )
+        var_x, var_y = mean_xx - mean_x**2, mean_yy - mean_y**2
+        cov_xy = mean_xy - mean_x * mean_y
+        # eigenvalues of the 2 x 2 covariance matrix are mean_eig +/- spread
+        mean_eig = (var_x + var_y) / 2
+        spread = np.sqrt(((var_x - var_y) / 2) ** 2 + cov_xy**2)
+        roundness = mean_eig / (mean_eig + spread)
+    return np.where(mask_matrix.getnnz(axis=1) > 1, roundness, np.nan)
+
+
+def find_nearby_mask_pairs(centers, max_distance):
+    """Pairs of masks whose centers lie within `max_distance` of each other.
+
+    Masks are binned in a grid of `max_distance` cells, so that only masks of
+    neighboring cells are compared.
+
+    Args:
+        centers (np.ndarray): (masks x 2) x and y coordinates of the mask centers.
+        max_distance (float): Maximum distance between the centers of a pair.
+
+    Returns:
+        pairs (np.ndarray): (pairs x 2) row indices (i, j) of each pair, with i < j.
+        distances (np.ndarray): Distance between the centers of each pair.
+    """
+    centers = np.asarray(centers, dtype=float).reshape(-1, 2)
+    cells = np.floor(centers / max_distance).astype(int)
+    grid = {}
+    for mask_idx, cell in enumerate(map(tuple, cells)):
+        grid.setdefault(cell, []).append(mask_idx)
+    grid = {cell: np.array(members) for cell, members in grid.items()}
+
+    pairs = []
+    for (cell_x, cell_y), members in grid.items():
+        # the cell itself and half of its neighbors, so that each pair of cells is
+        # visited once
+        for offset_x, offset_y in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+            others = grid.get((cell_x + offset_x, cell_y + offset_y))
+            if others is None:
+                continue
+            first, second = np.meshgrid(members, others, indexing="ij")
+            cell_pairs = np.stack([first.ravel(), second.ravel()], axis=1)
+            if offset_x == offset_y == 0:
+                cell_pairs = cell_pairs[cell_pairs[:, 0] < cell_pairs[:, 1]]
+            pairs.append(np.sort(cell_pairs, axis=1))
+
+    pairs = np.concatenate(pairs) if pairs else np.empty((0, 2), dtype=int)
+    distances = np.linalg.norm(centers[pairs[:, 0]] - centers[pairs[:, 1]], axis=1)
+    nearby = distances <= max_distance
+    return pairs[nearby], distances[nearby]
+
+
+def compute_pair_iou(mask_matrix, pairs):
+    """Intersection over union of the pixels of given pairs of masks.
+
+    Args:
+        mask_matrix (scipy.sparse.csr_matrix): (masks x pixels) masks.
+        pairs (np.ndarray): (pairs x 2) row indices of the pairs of masks.
+
+    Returns:
+        iou (np.ndarray): Intersection over union of each pair.
+    """
+    masks = (mask_matrix != 0).astype(np.float32).tocsr()
+    npix = np.asarray(masks.sum(axis=1)).ravel()
+    intersection = np.asarray(
+        masks[pairs[:, 0]].multiply(masks[pairs[:, 1]]).sum(axis=1)
+    ).ravel()
+    union = npix[pairs[:, 0]] + npix[pairs[:, 1]] - intersection
+    return np.divide(intersection, union, out=np.zeros(len(pairs)), where=union > 0)
+
+
+def compute_pair_correlations(traces, pairs, batch_size=4096):
+    """Pearson correlation of the traces of given pairs of masks.
+
+    Args:
+        traces (np.ndarray): (masks x frames) traces.
+        pairs (np.ndarray): (pairs x 2) row indices of the pairs of masks.
+        batch_size (int): Default 4096. Number of pairs correlated at once.
+
+    Returns:
+        correlations (np.ndarray): Correlation of each pair, NaN for constant traces.
+    """
+    traces = np.asarray(traces, dtype=np.float32)
+    centered = traces - traces.mean(axis=1, keepdims=True)
+    norms = np.linalg.norm(centered, axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        normalized = centered / norms
+
+    correlations = np.empty(len(pairs))
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start : start + batch_size]
+        correlations[start : start + batch_size] = np.einsum(
+            "ij,ij->i", normalized[batch[:, 0]], normalized[batch[:, 1]]
+        )
+    return correlations
+
+
+def mask_matrix_cache_info():
+    """Return hit/miss counts and size of the mask matrix cache of this process."""
+    return _mask_matrix_cache.info()
@@ -1,7 +1,12 @@
+import atexit
+import json
+import os
+import threading
 from collections import abc
+from pathlib import Path
 
 import datajoint as dj
-from element_interface.utils import find_full_path
+from element_interface.utils import find_root_directory
 from element_session import session_with_datetime as session  # If pipeline, circular
 
 
@@ -16,13 +21,209 @@ def get_imaging_root_data_dir():
         return imaging_root_dirs
 
 
+# relative path -> root directory, persisted at dj.config["custom"]["root_index_path"]
+_root_index = None
+_root_index_dirty = False
+_root_index_lock = threading.Lock()
+_root_index_stats = dict(hits=0, misses=0, stat_calls=0, stat_calls_saved=0)
+
+
+def _to_root_list(root_directories):
+    if isinstance(root_directories, (str, Path)):
+        return [Path(root_directories)]
+    return [Path(root_dir) for root_dir in root_directories or []]
+
+
+def _load_root_index():
+    """Load the root directory index from disk on first use."""
+    global _root_index
+    if _root_index is None:
+        _root_index = {}
+        root_index_path = dj.config["custom"].get("root_index_path")
+        if root_index_path and Path(root_index_path).exists():
+            try:
+                _root_index = json.loads(Path(root_index_path).read_text())
+            except ValueError:  # corrupt index, rebuilt by probing
+                pass
+    return _root_index
+
+
+def _save_root_index():
+    """Merge the root directory index into its file, if configured."""
+    root_index_path = dj.config["custom"].get("root_index_path")
+    if not root_index_path:
+        return
+    root_index_path = Path(root_index_path)
+    saved_index = {}
+    if root_index_path.exists():
+        try:
+            saved_index = json.loads(root_index_path.read_text())
+        except ValueError:
+            pass
+    tmp_path = root_index_path.with_suffix(f".{os.getpid()}.tmp")
+    tmp_path.write_text(json.dumps({**saved_index, **_root_index}))
+    os.replace(tmp_path, root_index_path)
+
+
+def flush_root_index():
+    """Write the new entries of the root directory index to its file, if configured.
+
+    New entries are only kept in memory by `find_full_path_cached`; they are written
+    by this function, which `ingest.discover_sessions` calls once all sessions are
+    located, and at interpreter exit.
+    """
+    global _root_index_dirty
+    with _root_index_lock:
+        if _root_index_dirty:
+            _save_root_index()
+            _root_index_dirty = False
+
+
+atexit.register(flush_root_index)
+
+
+def find_full_path_cached(root_directories, relative_path):
+    """Find the full path of a relative path, remembering the root it lives in.
+
+    Equivalent to `element_interface.utils.find_full_path`, but the root directory of
+    each relative path is kept in an index, so that the roots are only probed when
+    the path is not in the index or has moved. When
+    `dj.config["custom"]["root_index_path"]` is set, the index is persisted across
+    processes by `flush_root_index`.
+
+    Args:
+        root_directories (list): Potential root directories.
+        relative_path (str): Relative path to a file or directory.
+
+    Returns:
+        full_path (pathlib.Path): Full path to the file or directory.
+
+    Raises:
+        FileNotFoundError: If the path is not found under any of the root directories.
+    """
+    roots = _to_root_list(root_directories)
+    relative_path = Path(relative_path)
+    index_key = relative_path.as_posix()
+
+    with _root_index_lock:
+        root_dir = _load_root_index().get(index_key)
+
+    if root_dir is not None and Path(root_dir) in roots:
+        full_path = Path(root_dir) / relative_path
+        if full_path.exists():
+            with _root_index_lock:
+                _root_index_stats["hits"] += 1
+                _root_index_stats["stat_calls"] += 1
+                # probing checks the path itself, then each root in turn
+                _root_index_stats["stat_calls_saved"] += roots.index(Path(root_dir)) + 1
+            return full_path
+
+    stat_calls, full_path, found_root = 1, None, None
+    if relative_path.exists():
+        full_path = relative_path.absolute()
+    else:
+        for root_dir in roots:
+            stat_calls += 1
+            if (root_dir / relative_path).exists():
+                full_path, found_root = root_dir / relative_path, root_dir
+                break
+
+    global _root_index_dirty
+    with _root_index_lock:
+        _root_index_stats["misses"] += 1
+        _root_index_stats["stat_calls"] += stat_calls
+        if found_root is not None:
+            _root_index[index_key] = found_root.as_posix()
+            _root_index_dirty = True
+
+    if full_path is None:
+        raise FileNotFoundError(
+            f"No valid full-path found (from {roots}) for {relative_path}"
+        )
+    return full_path
+
+
+def find_root_directory_cached(root_directories, full_path):
+    """Find the root directory of a full path without accessing the file system.
+
+    Equivalent to `element_interface.utils.find_root_directory` for paths returned by
+    `find_full_path_cached`, which are known to exist.
+
+    Args:
+        root_directories (list): Potential root directories.
+        full_path (str): Full path to a file or directory.
+
+    Returns:
+        root_dir (pathlib.Path): The root directory containing `full_path`.
+    """
+    full_path = Path(full_path)
+    parents = set(full_path.parents)
+    for root_dir in _to_root_list(root_directories):
+        if root_dir in parents:
+            with _root_index_lock:
+                _root_index_stats["stat_calls_saved"] += 1
+            return root_dir
+    return find_root_directory(root_directories, full_path)
+
+
+def get_root_index_stats():
+    """Return the hits, misses, and file system stat calls made and saved by the root
+    directory index of this process."""
+    with _root_index_lock:
+        return dict(_root_index_stats, entries=len(_load_root_index()))
+
+
+# session key -> full session directory
+_session_dirs = {}
+# full session directory -> (mtime_ns, {file suffix: [file paths]})
+_file_index = {}
+
+
+def clear_file_index():
+    """Clear the cached session directories and their file listings."""
+    _session_dirs.clear()
+    _file_index.clear()
+
+
+def _get_session_dir(scan_key):
+    """Full session directory of a scan, cached per session."""
+    session_key = tuple(scan_key[k] for k in session.Session.primary_key)
+    sess_dir = _session_dirs.get(session_key)
+    if sess_dir is None or not sess_dir.exists():
+        sess_dir = find_full_path_cached(
+            get_imaging_root_data_dir(),
+            (session.SessionDirectory & scan_key).fetch1("session_dir"),
+        )
+        _session_dirs[session_key] = sess_dir
+    return sess_dir
+
+
+def _index_session_dir(sess_dir):
+    """Files of a session directory grouped by suffix, listed once per modification.
+
+    A single `os.scandir` serves all file types; the listing is reused until the
+    modification time of the directory changes.
+    """
+    mtime_ns = sess_dir.stat().st_mtime_ns
+    cached = _file_index.get(sess_dir)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    files_by_suffix = {}
+    with os.scandir(sess_dir) as entries:
+        for entry in entries:
+            files_by_suffix.setdefault(Path(entry.name).suffix, []).append(
+                Path(entry.path).as_posix()
+            )
+    _file_index[sess_dir] = (mtime_ns, files_by_suffix)
+    return files_by_suffix
+
+
 def _find_files_by_type(scan_key, filetype: str):
     """Uses roots + relative SessionDirectory, returns list of files with filetype"""
-    sess_dir = find_full_path(
-        get_imaging_root_data_dir(),
-        (session.SessionDirectory & scan_key).fetch1("session_dir"),
-    )
-    return sess_dir, [fp.as_posix() for fp in sess_dir.glob(filetype)]
+    sess_dir = _get_session_dir(scan_key)
+    suffix = filetype.lstrip("*")
+    return sess_dir, list(_index_session_dir(sess_dir).get(suffix, []))
 
 
 def get_scan_image_files(scan_key):
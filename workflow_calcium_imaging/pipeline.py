@@ -1,13 +1,8 @@
+import threading
+
 import datajoint as dj
-from element_animal import subject
-from element_animal.subject import Subject
-from element_calcium_imaging import imaging, scan
-from element_event import event, trial
-from element_lab import lab
-from element_lab.lab import Lab, Location, Project, Protocol, Source, User
-from element_session import session_with_datetime as session
-
-from . import analysis, db_prefix
+
+from . import db_prefix, previews, scan_metrics, stats
 from .paths import (
     get_imaging_root_data_dir,
     get_nd2_files,
@@ -15,7 +10,6 @@ from .paths import (
     get_scan_box_files,
     get_scan_image_files,
 )
-from .reference import Equipment
 
 __all__ = [
     "dj",
@@ -45,23 +39,127 @@ __all__ = [
 
 # Activate "lab", "subject", "session" schema -------------------------
 
-lab.activate(db_prefix + "lab")
 
-subject.activate(db_prefix + "subject", linking_module=__name__)
+def _activate_lab():
+    global lab, Lab, Location, Project, Protocol, Source, User, Experimenter
+    from element_lab import lab
+    from element_lab.lab import Lab, Location, Project, Protocol, Source, User
+
+    lab.activate(db_prefix + "lab")
+    Experimenter = lab.User
+
+
+def _activate_subject():
+    global subject, Subject
+    from element_animal import subject
+    from element_animal.subject import Subject
+
+    subject.activate(db_prefix + "subject", linking_module=__name__)
+
+
+def _activate_session():
+    global session, Session
+    from element_session import session_with_datetime as session
 
-Session = session.Session
-Experimenter = lab.User
-session.activate(db_prefix + "session", linking_module=__name__)
+    Session = session.Session
+    session.activate(db_prefix + "session", linking_module=__name__)
 
 
 # Activate "event" and "trial" schema ---------------------------------
 
-trial.activate(db_prefix + "trial", db_prefix + "event", linking_module=__name__)
+
+def _activate_trial():
+    global event, trial
+    from element_event import event, trial
+
+    trial.activate(db_prefix + "trial", db_prefix + "event", linking_module=__name__)
+
 
 # Activate "imaging" schema -------------------------------------------
 
-imaging.activate(db_prefix + "imaging", db_prefix + "scan", linking_module=__name__)
+
+def _activate_imaging():
+    global imaging, scan, Equipment
+    from element_calcium_imaging import imaging, scan
+
+    from .reference import Equipment
+
+    imaging.activate(db_prefix + "imaging", db_prefix + "scan", linking_module=__name__)
+    if dj.config["custom"].get("streaming_scan_metrics", False):
+        scan_metrics.install(scan)
+    if dj.config["custom"].get("preview_dir"):
+        previews.install(scan, imaging)
+    _instrument(scan, imaging)
+
 
 # Activate "analysis" schema ------------------------------------------
 
-analysis.activate(db_prefix + "analysis", linking_module=__name__)
+
+def _activate_analysis():
+    global analysis
+    from . import analysis
+
+    analysis.activate(db_prefix + "analysis", linking_module=__name__)
+    _instrument(analysis)
+
+
+# Record the resource usage of "make" in the "workflow_stats" schema ---
+
+
+def _instrument(*modules):
+    if dj.config["custom"].get("populate_stats", False):
+        stats.activate(db_prefix + "workflow_stats")
+        stats.instrument(*modules)
+
+
+# Activation groups: activator, upstream groups and names provided ----
+
+_activation_groups = {
+    "lab": (
+        _activate_lab,
+        (),
+        (
+            "lab",
+            "Lab",
+            "Location",
+            "Project",
+            "Protocol",
+            "Source",
+            "User",
+            "Experimenter",
+        ),
+    ),
+    "subject": (_activate_subject, ("lab",), ("subject", "Subject")),
+    "session": (_activate_session, ("subject",), ("session", "Session")),
+    "trial": (_activate_trial, ("session",), ("trial", "event")),
+    "imaging": (_activate_imaging, ("session",), ("imaging", "scan", "Equipment")),
+    "analysis": (_activate_analysis, ("trial", "imaging"), ("analysis",)),
+}
+_activated_groups = set()
+_activation_lock = threading.RLock()
+
+
+def _activate(group):
+    """Activate a group of schemas, after the groups it depends on."""
+    with _activation_lock:
+        if group in _activated_groups:
+            return
+        activator, upstream_groups, _ = _activation_groups[group]
+        for upstream_group in upstream_groups:
+            _activate(upstream_group)
+        activator()
+        _activated_groups.add(group)
+
+
+def __getattr__(name):
+    """Activate the schemas providing `name` on first access (lazy activation)."""
+    for group, (_, _, names) in _activation_groups.items():
+        if name in names:
+            _activate(group)
+            return globals()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+if not dj.config["custom"].get("lazy_activation", False):
+    for _group in _activation_groups:
+        _activate(_group)
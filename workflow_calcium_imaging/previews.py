@@ -0,0 +1,320 @@
+"""On-disk store of downsampled previews of scans and summary images.
+
+Previews are stored as `.npz` files named by the hash of their content, under
+`dj.config["custom"]["preview_dir"]`, and referenced by the hash of the key of the
+entry they preview. They are written during populate and read by `get_preview`.
+"""
+
+import functools
+import hashlib
+import os
+from math import ceil
+from pathlib import Path
+
+import datajoint as dj
+import numpy as np
+
+
+class PreviewStore:
+    """Content-addressed store of previews.
+
+    Each preview is a set of named arrays, saved in `objects/<hash>.npz`; the file
+    `refs/<kind>/<key hash>` holds the hash of the preview of a key.
+
+    Args:
+        preview_dir (str): Root directory of the store.
+    """
+
+    def __init__(self, preview_dir):
+        self.preview_dir = Path(preview_dir)
+
+    def _ref_path(self, kind, key):
+        return self.preview_dir / "refs" / kind / dj.key_hash(key)
+
+    def _object_path(self, content_hash):
+        return self.preview_dir / "objects" / content_hash[:2] / f"{content_hash}.npz"
+
+    def put(self, kind, key, **arrays):
+        """Store the preview of a key.
+
+        Args:
+            kind (str): Kind of preview, e.g. "scan_metrics".
+            key (dict): Primary key of the previewed entry.
+            **arrays (np.ndarray): Named arrays of the preview.
+
+        Returns:
+            content_hash (str): Hash of the preview content.
+        """
+        content_hash = hashlib.sha256()
+        for name in sorted(arrays):
+            array = np.ascontiguousarray(arrays[name])
+            content_hash.update(f"{name}:{array.dtype.str}:{array.shape}".encode())
+            content_hash.update(array.tobytes())
+        content_hash = content_hash.hexdigest()
+
+        object_path = self._object_path(content_hash)
+        if not object_path.exists():  # identical previews are stored once
+            _write_atomic(object_path, lambda f: np.savez(f, **arrays))
+        _write_atomic(
+            self._ref_path(kind, key), lambda f: f.write(content_hash.encode())
+        )
+        return content_hash
+
+    def get(self, kind, key):
+        """Load the preview of a key.
+
+        Args:
+            kind (str): Kind of preview, e.g. "scan_metrics".
+            key (dict): Primary key of the previewed entry.
+
+        Returns:
+            arrays (dict): Named arrays of the preview, or None if it is not stored.
+        """
+        try:
+            content_hash = self._ref_path(kind, key).read_text()
+            with np.load(self._object_path(content_hash)) as npz:
+                return dict(npz)
+        except FileNotFoundError:
+            return None
+
+
+def _write_atomic(path, write):
+    """Write a file through a temporary file, so readers never see a partial file."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "wb") as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def get_preview_store():
+    """Preview store in `dj.config["custom"]["preview_dir"]`, or None if not set."""
+    preview_dir = dj.config["custom"].get("preview_dir")
+    return PreviewStore(preview_dir) if preview_dir else None
+
+
+def get_preview_settings():
+    """Preview sizes, from `dj.config["custom"]`.
+
+    Returns:
+        max_samples (int): "preview_max_samples", default 2000. Maximum number of
+            samples of the per-frame metrics.
+        max_frames (int): "preview_max_frames", default 200. Maximum number of frames
+            of the movies.
+        spatial_factor (int): "preview_spatial_factor", default 4. Downsampling factor
+            of the height and width of movies and images.
+    """
+    return (
+        dj.config["custom"].get("preview_max_samples", 2000),
+        dj.config["custom"].get("preview_max_frames", 200),
+        dj.config["custom"].get("preview_spatial_factor", 4),
+    )
+
+
+# ---------------- Downsampling ----------------
+
+
+def downsample_traces(traces, max_samples, reduce=np.add):
+    """Reduce traces in consecutive bins of samples, to at most `max_samples`.
+
+    Args:
+        traces (np.ndarray): (... x samples) traces.
+        max_samples (int): Maximum number of samples of the downsampled traces.
+        reduce (np.ufunc): Default `np.add`, which averages each bin. `np.minimum` or
+            `np.maximum` keep the extremes of each bin.
+
+    Returns:
+        downsampled_traces (np.ndarray): (... x bins) downsampled traces.
+    """
+    nsamples = traces.shape[-1]
+    bin_starts = np.arange(0, nsamples, max(1, ceil(nsamples / max_samples)))
+    reduced = reduce.reduceat(traces, bin_starts, axis=-1)
+    if reduce is np.add:
+        counts = np.diff(np.append(bin_starts, nsamples))
+        reduced = reduced / counts
+    return reduced
+
+
+def downsample_frames(frames, spatial_factor):
+    """Average frames in `spatial_factor` x `spatial_factor` blocks of pixels.
+
+    Args:
+        frames (np.ndarray): (frames x height x width) frames.
+        spatial_factor (int): Downsampling factor of the height and width; edge pixels
+            that do not fill a block are dropped.
+
+    Returns:
+        downsampled_frames (np.ndarray): (frames x height x width) float32 frames.
+    """
+    nframes, height, width = np.shape(frames)
+    height, width = height // spatial_factor, width // spatial_factor
+    return (
+        np.asarray(frames)[:, : height * spatial_factor, : width * spatial_factor]
+        .reshape(nframes, height, spatial_factor, width, spatial_factor)
+        .mean(axis=(2, 4), dtype=np.float32)
+    )
+
+
+class MoviePreview:
+    """Accumulate a spatially and temporally downsampled copy of a movie.
+
+    Blocks of consecutive frames are added in order; frames are averaged in
+    `spatial_factor` x `spatial_factor` pixel blocks and in bins of frames so that the
+    preview has at most `max_frames` frames.
+
+    Args:
+        nframes (int): Number of frames of the movie.
+        max_frames (int): Maximum number of frames of the preview.
+        spatial_factor (int): Downsampling factor of the height and width.
+    """
+
+    def __init__(self, nframes, max_frames, spatial_factor):
+        self.temporal_factor = max(1, ceil(nframes / max_frames))
+        self.spatial_factor = spatial_factor
+        self._bins = []
+        self._remainder = None
+
+    def add(self, frames):
+        """Add a (frames x height x width) block of the next frames of the movie."""
+        frames = downsample_frames(frames, self.spatial_factor)
+        _, height, width = frames.shape
+        if self._remainder is not None:
+            frames = np.concatenate([self._remainder, frames])
+        nbinned = len(frames) // self.temporal_factor * self.temporal_factor
+        self._bins.append(
+            frames[:nbinned]
+            .reshape(-1, self.temporal_factor, height, width)
+            .mean(axis=1)
+        )
+        self._remainder = frames[nbinned:]
+
+    def result(self):
+        """Downsampled (frames x height x width) movie."""
+        bins = list(self._bins)
+        if self._remainder is not None and len(self._remainder):
+            bins.append(self._remainder.mean(axis=0, keepdims=True))
+        return np.concatenate(bins)
+
+
+# ---------------- Previews of the pipeline tables ----------------
+
+
+def build_scan_metrics_preview(key):
+    """Downsampled per-frame metrics of a `scan.ScanQualityMetrics` entry.
+
+    Args:
+        key (dict): Primary key of a scan.ScanQualityMetrics entry.
+
+    Returns:
+        preview (dict): (channels x samples) `min_intensity`, `mean_intensity`,
+            `max_intensity` and `contrast`, and the `channels`.
+    """
+    from . import pipeline
+
+    max_samples, _, _ = get_preview_settings()
+    channels, *metrics = (pipeline.scan.ScanQualityMetrics.Frames & key).fetch(
+        "channel",
+        "min_intensity",
+        "mean_intensity",
+        "max_intensity",
+        "contrast",
+        order_by="channel",
+    )
+    preview = dict(channels=channels)
+    for name, reduce, values in zip(
+        ("min_intensity", "mean_intensity", "max_intensity", "contrast"),
+        (np.minimum, np.add, np.maximum, np.add),
+        metrics,
+    ):
+        preview[name] = downsample_traces(
+            np.stack(values).astype(float), max_samples, reduce=reduce
+        )
+    return preview
+
+
+def build_summary_images_preview(key):
+    """Spatially downsampled summary images of a `imaging.MotionCorrection` field.
+
+    Args:
+        key (dict): Primary key of an imaging.MotionCorrection.Summary entry.
+
+    Returns:
+        preview (dict): Downsampled `ref_image`, `average_image`, and
+            `correlation_image` and `max_proj_image` if available.
+    """
+    from . import pipeline
+
+    _, _, spatial_factor = get_preview_settings()
+    summary = (pipeline.imaging.MotionCorrection.Summary & key).fetch1()
+    preview = {}
+    for name in ("ref_image", "average_image", "correlation_image", "max_proj_image"):
+        image = summary.get(name)
+        if image is not None:
+            preview[name] = downsample_frames(np.asarray(image)[None], spatial_factor)[
+                0
+            ]
+    return preview
+
+
+_preview_builders = {
+    "scan_metrics": build_scan_metrics_preview,
+    "summary_images": build_summary_images_preview,
+}
+
+
+def get_preview(kind, key):
+    """Preview of an entry, from the preview store when available.
+
+    Previews missing from the store are built from the database and stored.
+
+    Args:
+        kind (str): "scan_metrics" (key of scan.ScanQualityMetrics), "summary_images"
+            (key of imaging.MotionCorrection.Summary) or "scan_movie" (key of
+            scan.ScanQualityMetrics.Frames, stored only by the streaming
+            `scan_metrics` engine).
+        key (dict): Primary key of the previewed entry.
+
+    Returns:
+        preview (dict): Named arrays of the preview, or None for a missing
+            "scan_movie".
+    """
+    store = get_preview_store()
+    preview = store.get(kind, key) if store else None
+    if preview is None and kind in _preview_builders:
+        preview = _preview_builders[kind](key)
+        if store:
+            store.put(kind, key, **preview)
+    return preview
+
+
+def install(scan, imaging):
+    """Store previews of `scan.ScanQualityMetrics` and `imaging.MotionCorrection`.
+
+    Wraps the `make` of both tables to store the previews of the new entries.
+
+    Args:
+        scan (module): Activated `element_calcium_imaging.scan` module.
+        imaging (module): Activated `element_calcium_imaging.imaging` module.
+    """
+    _store_previews_after_make(scan.ScanQualityMetrics, "scan_metrics", None)
+    _store_previews_after_make(
+        imaging.MotionCorrection, "summary_images", imaging.MotionCorrection.Summary
+    )
+
+
+def _store_previews_after_make(table_class, kind, part_table):
+    make = table_class.make
+    if getattr(make, "_stores_previews", False):
+        return
+
+    @functools.wraps(make)
+    def make_and_store_previews(self, key):
+        make(self, key)
+        store = get_preview_store()
+        if store:
+            preview_keys = (part_table & key).fetch("KEY") if part_table else [key]
+            for preview_key in preview_keys:
+                store.put(kind, preview_key, **_preview_builders[kind](preview_key))
+
+    make_and_store_previews._stores_previews = True
+    table_class.make = make_and_store_previews
@@ -0,0 +1,43 @@
+"""Array routines computing quality metrics of many fluorescence traces at once."""
+
+import numpy as np
+
+
+def compute_trace_metrics(traces, rows_per_chunk=1024):
+    """Skewness, variance and signal-to-noise ratio of each trace.
+
+    Moments are computed on (traces x frames) blocks of `rows_per_chunk` traces,
+    stacked one block at a time. Skewness is the biased sample skewness, as
+    `scipy.stats.skew`. The signal-to-noise ratio is the standard deviation of the
+    trace divided by that of its frame-to-frame noise, estimated from the variance of
+    the first differences; it is about 1 for white noise and grows with slow, large
+    transients.
+
+    Args:
+        traces (np.ndarray): (traces x frames) traces, or sequence of traces of
+            equal length, e.g. an object array as fetched from the database.
+        rows_per_chunk (int): Default 1024. Number of traces per block, bounding the
+            memory of the float64 intermediate arrays.
+
+    Returns:
+        skewness (np.ndarray): Skewness of each trace, NaN for constant traces.
+        variance (np.ndarray): Variance of each trace.
+        snr (np.ndarray): Signal-to-noise ratio of each trace, NaN for constant
+            traces.
+    """
+    ntraces = len(traces)
+    skewness, variance, snr = np.empty(ntraces), np.empty(ntraces), np.empty(ntraces)
+    for start in range(0, ntraces, rows_per_chunk):
+        chunk = np.stack(traces[start : start + rows_per_chunk]).astype(np.float64)
+        centered = chunk - chunk.mean(axis=1, keepdims=True)
+        squared = centered**2
+        second_moment = squared.mean(axis=1)
+        third_moment = (squared * centered).mean(axis=1)
+        noise_variance = (np.diff(chunk, axis=1) ** 2).mean(axis=1) / 2
+
+        rows = slice(start, start + len(chunk))
+        variance[rows] = second_moment
+        with np.errstate(invalid="ignore", divide="ignore"):
+            skewness[rows] = third_moment / second_moment**1.5
+            snr[rows] = np.sqrt(second_moment / noise_variance)
+    return skewness, variance, snr
@@ -0,0 +1,201 @@
+"""Streaming computation of the per-frame metrics of `scan.ScanQualityMetrics`."""
+
+import functools
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+
+import datajoint as dj
+import numpy as np
+
+from . import previews
+from .paths import get_nd2_files, get_scan_box_files, get_scan_image_files
+
+_scan = None
+_original_make = None
+
+
+@contextmanager
+def open_frame_reader(acq_software, scan_key):
+    """Open a scan for reading blocks of frames of any field and channel.
+
+    The scan is opened once; frames are read only when requested: ScanImage files are
+    read page by page through scanreader, Scanbox files are memory-mapped, and ND2
+    files are read through dask.
+
+    Args:
+        acq_software (str): Acquisition software of the scan.
+        scan_key (dict): Primary key of a scan.Scan entry.
+
+    Yields:
+        read_frames (callable): `read_frames(field_idx, channel, start, stop)` returns
+            the (frames x height x width) array of frames `start` to `stop`, or None if
+            the acquisition software is not supported.
+        nframes (int): Number of frames.
+    """
+    if acq_software == "ScanImage":
+        import scanreader
+
+        loaded_scan = scanreader.read_scan(
+            [str(f) for f in get_scan_image_files(scan_key)]
+        )
+
+        def read_frames(field_idx, channel, start, stop):
+            # (height x width x frames), reading only the pages of these frames
+            frames = loaded_scan[field_idx, :, :, channel, start:stop]
+            return np.moveaxis(frames, -1, 0)
+
+        yield read_frames, loaded_scan.num_frames
+    elif acq_software == "Scanbox":
+        from sbxreader import sbx_memmap
+
+        # (frames x fields x channels x height x width)
+        movie = sbx_memmap(str(get_scan_box_files(scan_key)[0]))
+
+        def read_frames(field_idx, channel, start, stop):
+            return movie[start:stop, field_idx, channel]
+
+        yield read_frames, movie.shape[0]
+    elif acq_software == "NIS":
+        import nd2
+
+        with nd2.ND2File(str(get_nd2_files(scan_key)[0])) as nd2_file:
+            # index the frames, field and channel along the dimensions present
+            dims = list(nd2_file.sizes)
+            movie = nd2_file.to_dask()
+
+            def read_frames(field_idx, channel, start, stop):
+                index = {"Z": field_idx, "C": channel}
+                frames = movie[
+                    tuple(
+                        slice(start, stop)
+                        if dim == "T"
+                        else index.get(dim, slice(None))
+                        for dim in dims
+                    )
+                ].compute()
+                return frames if "T" in dims else frames[None]
+
+            yield read_frames, nd2_file.sizes.get("T", 1)
+    else:
+        yield None, 0
+
+
+def _get_chunk_metrics(frames):
+    """Per-frame metrics of a (frames x height x width) block of frames."""
+    frames = np.asarray(frames).reshape(len(frames), -1)
+    low, high = np.percentile(frames, [1, 99], axis=1)
+    return dict(
+        min_intensity=frames.min(axis=1),
+        mean_intensity=frames.mean(axis=1),
+        max_intensity=frames.max(axis=1),
+        contrast=high - low,
+    )
+
+
+def compute_frame_metrics(
+    read_frames, nframes, chunk_size=100, n_workers=None, on_frames=None
+):
+    """Compute the minimum, mean, maximum and contrast of each frame in one pass.
+
+    Blocks of frames are read in turn and reduced on a pool of threads; at most two
+    blocks per thread are held in memory at once.
+
+    Args:
+        read_frames (callable): `read_frames(start, stop)` returns the
+            (frames x height x width) array of frames `start` to `stop`.
+        nframes (int): Number of frames.
+        chunk_size (int): Default 100. Number of frames per block.
+        n_workers (int): Number of threads. Defaults to the number of CPUs.
+        on_frames (callable): Optional. Called with each block of frames, in order,
+            e.g. `previews.MoviePreview.add`.
+
+    Returns:
+        metrics (dict): Arrays of `min_intensity`, `mean_intensity`, `max_intensity`
+            and `contrast` (difference between the 99 and 1 percentiles) per frame,
+            empty without frames.
+    """
+    n_workers = n_workers or os.cpu_count()
+    chunk_starts = range(0, nframes, chunk_size)
+    chunk_metrics = [None] * len(chunk_starts)
+
+    with ThreadPoolExecutor(max_workers=n_workers) as executor:
+        pending = {}
+        for chunk_idx, start in enumerate(chunk_starts):
+            frames = read_frames(start, min(start + chunk_size, nframes))
+            if on_frames is not None:
+                on_frames(frames)
+            pending[executor.submit(_get_chunk_metrics, frames)] = chunk_idx
+            if len(pending) >= 2 * n_workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk_metrics[pending.pop(future)] = future.result()
+        for future, chunk_idx in pending.items():
+            chunk_metrics[chunk_idx] = future.result()
+
+    return {
+        name: (
+            np.concatenate([metrics[name] for metrics in chunk_metrics])
+            if chunk_metrics
+            else np.empty(0)  # scan without frames
+        )
+        for name in ("min_intensity", "mean_intensity", "max_intensity", "contrast")
+    }
+
+
+def install(scan):
+    """Compute `scan.ScanQualityMetrics` with `compute_frame_metrics`.
+
+    Replaces `scan.ScanQualityMetrics.make`; scans of unsupported acquisition software
+    are computed by the original `make`.
+
+    Args:
+        scan (module): Activated `element_calcium_imaging.scan` module.
+    """
+    global _scan, _original_make
+    _scan = scan
+    if _original_make is None:
+        _original_make = scan.ScanQualityMetrics.make
+    scan.ScanQualityMetrics.make = _make_scan_quality_metrics
+
+
+def _make_scan_quality_metrics(self, key):
+    acq_software, nchannels = (_scan.Scan * _scan.ScanInfo & key).fetch1(
+        "acq_software", "nchannels"
+    )
+    if acq_software not in ("ScanImage", "Scanbox", "NIS"):
+        return _original_make(self, key)
+
+    chunk_size = dj.config["custom"].get("scan_metrics_chunk_size", 100)
+    n_workers = dj.config["custom"].get("scan_metrics_workers")
+
+    preview_store = previews.get_preview_store()
+    _, max_frames, spatial_factor = previews.get_preview_settings()
+
+    frames, movie_previews = [], {}
+    with open_frame_reader(acq_software, key) as (read_frames, nframes):
+        for channel in range(nchannels):
+            # the downsampled movie of the preview store is built in the same pass
+            movie_preview = (
+                previews.MoviePreview(nframes, max_frames, spatial_factor)
+                if preview_store
+                else None
+            )
+            metrics = compute_frame_metrics(
+                functools.partial(read_frames, key["field_idx"], channel),
+                nframes,
+                chunk_size=chunk_size,
+                n_workers=n_workers,
+                on_frames=movie_preview and movie_preview.add,
+            )
+            frames.append(dict(key, channel=channel, **metrics))
+            movie_previews[channel] = movie_preview
+
+    self.insert1(key)
+    self.Frames.insert(frames)
+
+    if preview_store:
+        for channel, movie_preview in movie_previews.items():
+            preview_store.put(
+                "scan_movie", dict(key, channel=channel), movie=movie_preview.result()
+            )
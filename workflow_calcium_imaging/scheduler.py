@@ -0,0 +1,163 @@
+"""Concurrent populate of the auto-populated tables of the pipeline.
+
+Usage:
+    python -m workflow_calcium_imaging.scheduler
+"""
+
+import inspect
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import datajoint as dj
+import networkx as nx
+
+from . import pipeline
+from .utils import init_populate_worker, populate_key
+
+_schema_modules = ("scan", "imaging", "analysis")
+
+
+def get_populate_tables():
+    """Auto-populated tables of the activated pipeline, in dependency order.
+
+    Returns:
+        tables (dict): Table class of each table, named "<module>.<Table>" after its
+            module in `workflow_calcium_imaging.pipeline`, in topological order.
+    """
+    tables = {}
+    for module_name in _schema_modules:
+        module = getattr(pipeline, module_name)
+        for name, obj in vars(module).items():
+            if (
+                inspect.isclass(obj)
+                and issubclass(obj, (dj.Imported, dj.Computed))
+                and obj.__module__ == module.__name__
+            ):
+                tables[f"{module_name}.{name}"] = obj
+
+    dependencies = dj.conn().dependencies
+    dependencies.load()
+    topo_order = {
+        full_table_name: order
+        for order, full_table_name in enumerate(nx.topological_sort(dependencies))
+    }
+    return dict(
+        sorted(tables.items(), key=lambda item: topo_order[item[1].full_table_name])
+    )
+
+
+def _get_downstream_tables(tables):
+    """Names of the auto-populated tables downstream of each table."""
+    dependencies = dj.conn().dependencies
+    names = {table.full_table_name: name for name, table in tables.items()}
+    return {
+        name: [
+            names[descendant]
+            for descendant in dependencies.descendants(table.full_table_name)
+            if descendant in names and descendant != table.full_table_name
+        ]
+        for name, table in tables.items()
+    }
+
+
+def run(*restrictions, n_workers=None, requery_interval=1.0, verbose=True):
+    """Populate all auto-populated tables of the pipeline concurrently.
+
+    Each key of each table is populated as a separate task, with
+    `populate(key, reserve_jobs=True)`, by a pool of worker processes holding their
+    own database connections. As keys complete, the pending keys of the downstream
+    tables are queried and submitted, so that downstream tables do not wait for whole
+    upstream tables to complete. Keys reserved by another process may also have been
+    completed, and update their downstream tables likewise. Each table is queried at
+    most once every `requery_interval` seconds. Tables downstream of a manual table
+    (e.g. imaging.Curation) only proceed once its entries are inserted.
+
+    Args:
+        restrictions: Restrictions applied to the key source of every table.
+        n_workers (int): Number of worker processes. Defaults to
+            `dj.config["custom"]["populate_workers"]`, or the number of CPUs.
+        requery_interval (float): Minimum time in seconds between two queries of the
+            pending keys of a table. Default 1.0.
+        verbose (bool): Default True. Display the outcome and wall time of each task.
+
+    Returns:
+        report (list): One dictionary per task with the `table` name, the `key`, its
+            `status` ("success", "error" or "reserved" by another process),
+            `wall_time` (s) and `error_message`.
+    """
+    tables = get_populate_tables()
+    downstream_tables = _get_downstream_tables(tables)
+    n_workers = (
+        n_workers or dj.config["custom"].get("populate_workers") or os.cpu_count()
+    )
+
+    submitted, in_flight, report = set(), {}, []
+    start_time = time.time()
+
+    with ProcessPoolExecutor(
+        max_workers=n_workers,
+        initializer=init_populate_worker,
+        initargs=(pipeline.__name__,),
+    ) as executor:
+
+        def submit_pending(table_names):
+            for table_name in tables:  # in dependency order
+                if table_name not in table_names:
+                    continue
+                table = tables[table_name]()
+                pending_keys = (
+                    (table.key_source & dj.AndList(restrictions)) - table
+                ).fetch("KEY")
+                for key in pending_keys:
+                    task = (table_name, dj.key_hash(key))
+                    if task in submitted:  # attempted already, e.g. failed
+                        continue
+                    submitted.add(task)
+                    future = executor.submit(_populate_key, table_name, key)
+                    in_flight[future] = table_name
+
+        submit_pending(set(tables))
+        updated_tables, query_time = set(), time.time()
+        while in_flight or updated_tables:
+            timeout = (
+                max(0, query_time + requery_interval - time.time())
+                if updated_tables
+                else None
+            )
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                table_name = in_flight.pop(future)
+                result = future.result()
+                report.append(result)
+                if verbose:
+                    print(
+                        f"{table_name}: {result['status']} in"
+                        + f" {result['wall_time']:.2f}s {result['key']}"
+                    )
+                if result["status"] in ("success", "reserved"):
+                    updated_tables.update(downstream_tables[table_name])
+            if updated_tables and (
+                not in_flight or time.time() - query_time >= requery_interval
+            ):
+                submit_pending(updated_tables)
+                updated_tables, query_time = set(), time.time()
+
+    if verbose:
+        print(
+            f"\n---- Completed {sum(r['status'] == 'success' for r in report)}"
+            + f"/{len(report)} populate task(s) in {time.time() - start_time:.2f}s"
+            + " ----"
+        )
+    return report
+
+
+def _populate_key(table_name, key):
+    """Populate one key of a table of the pipeline in a worker process."""
+    module_name, class_name = table_name.split(".")
+    table = getattr(getattr(pipeline, module_name), class_name)
+    return dict(table=table_name, **populate_key(table, key))
+
+
+if __name__ == "__main__":
+    run()
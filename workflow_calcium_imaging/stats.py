@@ -0,0 +1,156 @@
+import functools
+import inspect
+import time
+from datetime import datetime
+
+import datajoint as dj
+
+from .utils import get_peak_rss
+
+schema = dj.schema()
+
+
+def activate(schema_name, *, create_schema=True, create_tables=True):
+    """Activate this schema.
+
+    Args:
+        schema_name (str): Schema name on the database server to activate the
+            `workflow_stats` schema.
+        create_schema (bool): When True (default), create schema in the database if it
+            does not yet exist.
+        create_tables (bool): When True (default), create tables in the database if they
+            do not yet exist.
+    """
+    schema.activate(
+        schema_name, create_schema=create_schema, create_tables=create_tables
+    )
+
+
+@schema
+class PopulateStats(dj.Manual):
+    """Resource usage of each `make` call of the instrumented tables.
+
+    Attributes:
+        table_name (str): Name of the table, as "<module>.<Table>".
+        key_hash (uuid): Hash of the populated key.
+        make_time (datetime): Time at which `make` started.
+        key (longblob): Populated key.
+        wall_time (float): Wall time of `make` in seconds.
+        cpu_time (float): CPU time of `make` in seconds, in the calling process only.
+        peak_rss (float): Optional. Peak resident set size of the process so far, at
+            the end of `make`, in MB. It is the high-water mark of the process, so in a
+            long-lived worker it includes the usage of earlier `make` calls.
+        bytes_fetched (int): Bytes sent by the database server during `make`.
+        bytes_inserted (int): Bytes received by the database server during `make`.
+    """
+
+    definition = """
+    table_name: varchar(255)
+    key_hash: uuid
+    make_time: datetime(3)
+    ---
+    key: longblob
+    wall_time: float  # (s)
+    cpu_time: float  # (s)
+    peak_rss=null: float  # process peak so far, at the end of make (MB)
+    bytes_fetched: bigint unsigned
+    bytes_inserted: bigint unsigned
+    """
+
+
+def instrument(*modules):
+    """Record the resource usage of every `make` call in `PopulateStats`.
+
+    Wraps the `make` method of the auto-populated tables defined in the given modules.
+    The entry of `PopulateStats` is inserted in the transaction of `populate`, so that
+    only successful `make` calls are recorded. Tables already instrumented and tables
+    with a generator `make` are left unchanged.
+
+    Args:
+        modules (module): Activated schema modules, e.g. `imaging`, `scan`.
+    """
+    for module in modules:
+        module_name = module.__name__.split(".")[-1]
+        for name, table_class in vars(module).items():
+            if (
+                inspect.isclass(table_class)
+                and issubclass(table_class, (dj.Imported, dj.Computed))
+                and table_class.__module__ == module.__name__
+                and "make" in vars(table_class)
+                and not getattr(table_class.make, "_instrumented", False)
+                and not inspect.isgeneratorfunction(table_class.make)
+            ):
+                table_class.make = _instrument_make(
+                    table_class.make, f"{module_name}.{name}"
+                )
+
+
+def _instrument_make(make, table_name):
+    @functools.wraps(make)
+    def instrumented_make(self, key):
+        make_time = datetime.utcnow()
+        bytes_fetched, bytes_inserted = _get_session_bytes(self.connection)
+        start_time, start_cpu_time = time.perf_counter(), time.process_time()
+
+        make(self, key)
+
+        wall_time = time.perf_counter() - start_time
+        cpu_time = time.process_time() - start_cpu_time
+        end_bytes_fetched, end_bytes_inserted = _get_session_bytes(self.connection)
+        peak_rss = get_peak_rss()
+
+        PopulateStats.insert1(
+            dict(
+                table_name=table_name,
+                key_hash=dj.key_hash(key),
+                make_time=make_time,
+                key=key,
+                wall_time=wall_time,
+                cpu_time=cpu_time,
+                peak_rss=None if peak_rss is None else peak_rss / 1024**2,
+                bytes_fetched=end_bytes_fetched - bytes_fetched,
+                bytes_inserted=end_bytes_inserted - bytes_inserted,
+            )
+        )
+
+    instrumented_make._instrumented = True
+    return instrumented_make
+
+
+def _get_session_bytes(connection):
+    """Bytes sent and received by the database server in this session."""
+    status = dict(
+        connection.query(
+            "SHOW SESSION STATUS WHERE Variable_name IN"
+            " ('Bytes_sent', 'Bytes_received')"
+        ).fetchall()
+    )
+    return int(status["Bytes_sent"]), int(status["Bytes_received"])
+
+
+def get_report(*restrictions, quantiles=(0.5, 0.95)):
+    """Summarize the resource usage of `make` per table.
+
+    Args:
+        restrictions: Restrictions applied to `PopulateStats`, e.g.
+            `'make_time > "2024-01-01"'`.
+        quantiles (tuple): Quantiles reported for each measure. Default is the median
+            and the 95th percentile.
+
+    Returns:
+        report (pandas.DataFrame): Number of `make` calls, and quantiles of wall time,
+            CPU time, process peak RSS so far and bytes fetched and inserted, for each
+            table.
+    """
+    stats = (
+        (PopulateStats & dj.AndList(restrictions))
+        .proj("wall_time", "cpu_time", "peak_rss", "bytes_fetched", "bytes_inserted")
+        .fetch(format="frame")
+        .reset_index()
+        .drop(columns=["key_hash", "make_time"])
+    )
+    grouped = stats.astype({"peak_rss": float}).groupby("table_name")
+    report = grouped.quantile(list(quantiles)).unstack()
+    report.columns = [f"{measure}_p{q * 100:g}" for measure, q in report.columns]
+    report.insert(0, "count", grouped.size())
+    return report
@@ -0,0 +1,147 @@
+import importlib
+import sys
+import time
+from collections import OrderedDict
+
+import datajoint as dj
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def get_peak_rss():
+    """Return the peak resident set size of the current process.
+
+    Returns:
+        peak_rss (int): Peak resident set size in bytes, or None if the platform does
+            not report it.
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    return peak_rss if sys.platform == "darwin" else peak_rss * 1024
+
+
+def init_populate_worker(pipeline_module_name):
+    """Activate the pipeline in a worker process and open its own connection.
+
+    Args:
+        pipeline_module_name (str): Name of the module activating the schemas.
+    """
+    importlib.import_module(pipeline_module_name)
+    dj.conn().connect()
+
+
+def populate_key(table, key):
+    """Populate one key of an auto-populated table, e.g. in a worker process.
+
+    Args:
+        table (dj.Computed): Auto-populated table class.
+        key (dict): Key of the key source of the table.
+
+    Returns:
+        result (dict): The `key`, its `status` ("success", "error" or "reserved" by
+            another process), `wall_time` (s) and `error_message`.
+    """
+    start_time = time.time()
+    errors = table.populate(
+        key, reserve_jobs=True, suppress_errors=True, return_exception_objects=True
+    )
+    if isinstance(errors, dict):  # datajoint>=0.14 also returns the success count
+        errors = errors["error_list"]
+    wall_time = time.time() - start_time
+
+    if errors:
+        status, error_message = "error", str(errors[0][1])
+    elif table & key:
+        status, error_message = "success", None
+    else:
+        status, error_message = "reserved", None
+    return dict(
+        key=key, status=status, wall_time=wall_time, error_message=error_message
+    )
+
+
+class LRUCache:
+    """Process-local least-recently-used cache bounded by the size of its values.
+
+    Values are tuples whose NumPy arrays, including memory-mapped ones, and
+    scipy.sparse matrices count towards `max_bytes`; the least recently used entries
+    are evicted once the total exceeds it. Nothing is cached when `max_bytes` is 0.
+
+    Args:
+        max_bytes (int): Maximum total size of the cached arrays in bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._nbytes = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    @property
+    def nbytes(self):
+        """Total size of the cached arrays in bytes."""
+        return sum(self._nbytes.values())
+
+    def get(self, key, default=None):
+        """Return the cached value for `key`, counting a hit or a miss."""
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        self.misses += 1
+        return default
+
+    def put(self, key, value):
+        """Cache `value` under `key`, evicting least recently used entries."""
+        nbytes = sum(_get_nbytes(v) for v in value)
+        self.pop(key)
+        if not self.max_bytes or nbytes > self.max_bytes:
+            return
+        self._entries[key] = value
+        self._nbytes[key] = nbytes
+        while self.nbytes > self.max_bytes:
+            self.pop(next(iter(self._entries)))
+
+    def pop(self, key):
+        """Remove `key` from the cache, if present."""
+        self._nbytes.pop(key, None)
+        return self._entries.pop(key, None)
+
+    def clear(self):
+        """Remove all entries and reset the hit and miss counters."""
+        self._entries.clear()
+        self._nbytes.clear()
+        self.hits = self.misses = 0
+
+    def info(self):
+        """Return the hit and miss counts, number of entries and cached bytes."""
+        return dict(
+            hits=self.hits,
+            misses=self.misses,
+            entries=len(self),
+            nbytes=self.nbytes,
+            max_bytes=self.max_bytes,
+        )
+
+
+def _get_nbytes(value):
+    """Size of an array or scipy.sparse matrix, 0 for other values.
+
+    Memory-mapped arrays are charged the size of their file, so that the cache also
+    bounds the number of files it keeps open.
+    """
+    if hasattr(value, "indptr"):  # compressed sparse matrix
+        return value.data.nbytes + value.indices.nbytes + value.indptr.nbytes
+    return getattr(value, "nbytes", 0)